@@ -0,0 +1,145 @@
+"""
+Benchmark composite-tile enhancement against per-crop fan-out.
+
+Usage (from backend/):
+    python -m benchmarks.bench_composite                   # offline latency model
+    python -m benchmarks.bench_composite --queue 6 --per-mp 1.2
+    python -m benchmarks.bench_composite --live            # real Seedream calls (needs ARK_API_KEY)
+
+Offline, the local overhead (packing, PNG encoding, splitting) is measured for
+real and upstream latency is simulated: each call waits an exponentially
+distributed queueing delay (mean --queue seconds) plus --per-mp seconds per
+output megapixel. Fan-out issues its calls in parallel, so it pays the
+slowest of three queueing delays; the composite pays one, but renders a
+larger canvas. Feed in numbers measured with --live to make the model
+meaningful. Cost is Seedream's per-image price (SEEDREAM_COST_PER_IMAGE).
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_matting import synthetic_ring  # noqa: E402
+from utils.composite import compose_crops, output_size, split_composite  # noqa: E402
+from utils.image_processor import ImageProcessor  # noqa: E402
+from utils.payload import output_max_side  # noqa: E402
+from utils.seedream_client import SEEDREAM_COST_PER_IMAGE, track_usage, usage_cost  # noqa: E402
+
+from PIL import Image  # noqa: E402
+
+# Output megapixels Seedream renders for a size preset (square-ish output)
+OUTPUT_MP = {size: output_max_side(size) ** 2 / 1e6 for size in ("1K", "2K", "4K")}
+
+
+def synthetic_crops(jewelry_type="ring"):
+    image, _ = synthetic_ring(size=2048)
+    ok, encoded = cv2.imencode(".png", image)
+    crops = ImageProcessor()._crop_regions(encoded.tobytes(), jewelry_type)
+    return {name: base64.b64decode(url.split(",", 1)[1]) for name, url in crops.items()}
+
+
+def local_overhead(crops, repeat=5):
+    """Best-of compose + split time (ms) and the bytes each strategy uploads"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        canvas, layout = compose_crops(crops)
+        compose_seconds = time.perf_counter() - started
+        # Stand-in for the enhanced result: the canvas at the W x H requested for a 4K composite
+        img = Image.open(io.BytesIO(canvas))
+        width, height = (int(side) for side in output_size(layout, "4K").split("x"))
+        buffer = io.BytesIO()
+        img.resize((width, height)).save(buffer, format="PNG")
+        started = time.perf_counter()
+        if split_composite(buffer.getvalue(), layout) is None:
+            raise RuntimeError("requested output size does not keep the canvas aspect")
+        elapsed = compose_seconds + time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(canvas), sum(len(c) for c in crops.values()), layout
+
+
+def simulate(calls, output_mp, queue_mean, per_mp, trials=2000, seed=7):
+    """Wall-clock seconds for `calls` parallel calls each rendering `output_mp` megapixels"""
+    rng = random.Random(seed)
+    samples = sorted(
+        max(rng.expovariate(1 / queue_mean) for _ in range(calls)) + per_mp * output_mp
+        for _ in range(trials)
+    )
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))]
+
+
+async def live(crops, size):
+    """Run both strategies against Seedream and report wall time and billed images"""
+    from utils.image_generator import JewelryImageGenerator
+
+    generator = JewelryImageGenerator()
+    if not generator.has_api_key:
+        print("ARK_API_KEY is not set; skipping the live run")
+        return
+    data_urls = {name: f"data:image/png;base64,{base64.b64encode(c).decode('utf-8')}" for name, c in crops.items()}
+    prompt = "Enhance this jewelry close-up. Keep the exact same design; only improve clarity and lighting."
+
+    with track_usage() as usage:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            generator.enhance_crop(url, prompt, mode="remote", size=size) for url in data_urls.values()
+        ])
+        fan_out = time.perf_counter() - started
+    print(f"live per-crop fan-out: {fan_out:6.1f}s  calls={usage['calls']}  cost=${usage_cost(usage):.3f}")
+
+    with track_usage() as usage:
+        started = time.perf_counter()
+        result = await generator.enhance_crops_composite(data_urls, prompt, size=size)
+        composite = time.perf_counter() - started
+    status = "ok" if result else "failed (fell back)"
+    print(f"live composite:        {composite:6.1f}s  calls={usage['calls']}  cost=${usage_cost(usage):.3f}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", default="ring", help="jewelry type used to pick the crop regions")
+    parser.add_argument("--size", default="2K", help="per-crop output size")
+    parser.add_argument("--queue", type=float, default=4.0, help="mean upstream queueing delay per call (s)")
+    parser.add_argument("--per-mp", type=float, default=1.0, help="upstream render time per output megapixel (s)")
+    parser.add_argument("--live", action="store_true", help="also run both strategies against Seedream")
+    args = parser.parse_args()
+
+    crops = synthetic_crops(args.type)
+    overhead_ms, canvas_bytes, crop_bytes, layout = local_overhead(crops)
+    print(f"{len(crops)} crops {[tuple(b[2:]) for b in layout['tiles'].values()]} -> canvas {tuple(layout['canvas'])} "
+          f"(aspect {layout['canvas'][0] / layout['canvas'][1]:.2f})")
+    print(f"upload bytes: fan-out {crop_bytes / 1024:.0f}KB, composite {canvas_bytes / 1024:.0f}KB")
+    print(f"composite local overhead (pack + encode + split): {overhead_ms:.0f}ms\n")
+
+    def requested_mp(size):
+        width, height = (int(side) for side in output_size(layout, size).split("x"))
+        return width * height / 1e6
+
+    composite_size = {"1K": "2K", "2K": "4K"}.get(args.size, args.size)
+    rows = [
+        (f"per-crop fan-out ({len(crops)} x {args.size})", len(crops), OUTPUT_MP[args.size], len(crops), 0.0),
+        (f"composite (1 x {output_size(layout, composite_size)})", 1, requested_mp(composite_size), 1,
+         overhead_ms / 1000),
+        (f"composite (1 x {output_size(layout, args.size)}, lower res)", 1, requested_mp(args.size), 1,
+         overhead_ms / 1000),
+    ]
+    print(f"{'strategy':<36}{'calls':>6}{'p50 s':>8}{'p95 s':>8}{'cost $':>8}")
+    for name, calls, mp, images, extra in rows:
+        p50, p95 = simulate(calls, mp, args.queue, args.per_mp)
+        print(f"{name:<36}{calls:>6}{p50 + extra:>8.1f}{p95 + extra:>8.1f}{images * SEEDREAM_COST_PER_IMAGE:>8.3f}")
+
+    if args.live:
+        asyncio.run(live(crops, args.size))
+
+
+if __name__ == "__main__":
+    main()
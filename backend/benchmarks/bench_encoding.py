@@ -0,0 +1,144 @@
+"""
+Benchmark response encoding for image-heavy /finalize payloads.
+
+Usage (from backend/):
+    python -m benchmarks.bench_encoding                   # synthetic 2K shots
+    python -m benchmarks.bench_encoding --images 6 --size 1024
+    python -m benchmarks.bench_encoding path/to/images    # real generations
+
+Builds a finalize-shaped response (cut-out originals plus sketches, every
+image an inline base64 PNG) and encodes it the way FastAPI does by default
+(jsonable_encoder + stdlib json) and through utils.encoding (orjson, gzip,
+brotli when installed, multipart with raw image parts), including the path a
+browser sending Accept-Encoding: gzip now takes. Reports best-of wall
+time, peak Python memory allocated while encoding (tracemalloc) and the bytes
+sent. Synthetic images get mild sensor noise so PNG sizes resemble real renders.
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from benchmarks.bench_matting import synthetic_ring  # noqa: E402
+from utils import encoding  # noqa: E402
+
+
+def _data_url(png: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+
+
+def synthetic_payload(count, size, seed=7):
+    rng = np.random.default_rng(seed)
+    originals, sketches = [], []
+    for index in range(count):
+        image, alpha = synthetic_ring(size=size)
+        noise = rng.normal(0, 3, image.shape)
+        image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+        cutout = np.dstack([image, alpha])
+        sketch = 255 - cv2.Canny(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 40, 120)
+        originals.append({"url": _data_url(cv2.imencode(".png", cutout)[1].tobytes()), "angle": f"view {index}"})
+        sketches.append({"url": _data_url(cv2.imencode(".png", sketch)[1].tobytes()), "angle": f"view {index}"})
+    return originals, sketches
+
+
+def folder_payload(path):
+    originals = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            with open(os.path.join(path, name), "rb") as f:
+                originals.append({"url": _data_url(f.read()), "angle": name})
+    return originals, list(originals)
+
+
+def fastapi_default(content):
+    """What returning the dict from an endpoint costs"""
+    return [JSONResponse(jsonable_encoder(content)).body]
+
+
+def negotiated_default(content):
+    """What a browser or axios client (Accept-Encoding: gzip, deflate, br) now gets"""
+    return [encoding.encode_json(content, encoding.json_encoding_for(content, "gzip, deflate, br"))[0]]
+
+
+def orjson_plain(content):
+    return [encoding.encode_json(content)[0]]
+
+
+def orjson_gzip(content):
+    return [encoding.encode_json(content, "gzip")[0]]
+
+
+def orjson_brotli(content):
+    return [encoding.encode_json(content, "br")[0]]
+
+
+def multipart(content):
+    return encoding.encode_multipart(content)[0]
+
+
+def measure(strategy, content, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = strategy(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    sent = sum(len(chunk) for chunk in chunks)
+    del chunks
+
+    tracemalloc.start()
+    chunks = strategy(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del chunks
+    return best * 1000, peak, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="folder of real images to use instead of synthetic ones")
+    parser.add_argument("--images", type=int, default=4, help="synthetic images per list (originals and sketches)")
+    parser.add_argument("--size", type=int, default=2048, help="synthetic image side in pixels")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    originals, sketches = folder_payload(args.path) if args.path else synthetic_payload(args.images, args.size)
+    content = {
+        "session_id": "00000000-0000-0000-0000-000000000000",
+        "original_images": originals,
+        "sketches": sketches,
+        "prompt": "gold ring with a ruby",
+    }
+    payload_mb = sum(len(item["url"]) for item in originals + sketches) / 1e6
+    print(f"{len(originals)} originals + {len(sketches)} sketches, {payload_mb:.1f}MB of data URLs "
+          f"(orjson {'installed' if encoding.orjson else 'missing'}, "
+          f"brotli {'installed' if encoding.brotli else 'missing'})\n")
+
+    strategies = [
+        ("fastapi default (jsonable_encoder)", fastapi_default),
+        ("negotiated default (gzip-accepting)", negotiated_default),
+        ("orjson", orjson_plain),
+        (f"orjson + gzip (level {encoding.RESPONSE_GZIP_LEVEL})", orjson_gzip),
+        ("multipart/mixed (raw images)", multipart),
+    ]
+    if encoding.brotli is not None:
+        strategies.insert(3, (f"orjson + brotli (quality {encoding.RESPONSE_BROTLI_QUALITY})", orjson_brotli))
+
+    print(f"{'strategy':<38}{'time ms':>9}{'peak MB':>9}{'sent MB':>9}")
+    for name, strategy in strategies:
+        elapsed_ms, peak, sent = measure(strategy, content, args.repeat)
+        print(f"{name:<38}{elapsed_ms:>9.1f}{peak / 1e6:>9.1f}{sent / 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
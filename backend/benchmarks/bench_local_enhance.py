@@ -0,0 +1,114 @@
+"""
+Check and time tiled local enhancement against a single-tile run.
+
+Usage (from backend/):
+    python -m benchmarks.bench_local_enhance
+
+Tiling must not change the result: for crops whose scale is capped to a
+non-integer factor (e.g. a 1228px necklace crop at 2K becomes ~1.67x) every
+tile has to sample the same source coordinates as an untiled run. Each case
+is enhanced with the default TILE and with one tile covering the whole image;
+the script exits non-zero if any pixel differs.
+
+The enhancement must also keep the product's colour: the mean CIE76 delta E
+between the object in the output and a plain Lanczos upscale has to stay
+under MAX_DELTA_E, and the white backdrop must not shift (light crops once
+came out grey with inverted tones).
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_matting import synthetic_ring  # noqa: E402
+from utils.local_enhancer import TILE, enhance_image_bytes  # noqa: E402
+from utils.matting import BG_DISTANCE  # noqa: E402
+
+# Mean delta E on the object above which the colour shift is plainly visible
+MAX_DELTA_E = 6.0
+# Mean shift (0-255 levels) allowed on the backdrop
+MAX_BACKDROP_SHIFT = 1.0
+
+
+def _png(image) -> bytes:
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def _decode(data: bytes):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def _lab(image):
+    return cv2.cvtColor(image[..., :3].astype(np.float32) / 255.0, cv2.COLOR_BGR2LAB)
+
+
+def fidelity(source, output):
+    """(mean delta E on the object, mean absolute shift on the backdrop) against a plain Lanczos upscale"""
+    height, width = output.shape[:2]
+    reference = cv2.resize(source, (width, height), interpolation=cv2.INTER_LANCZOS4)
+    if source.shape[2] == 4:
+        obj = reference[..., 3] >= 128
+    else:
+        colour = reference.astype(np.float32)
+        border = np.concatenate([colour[0], colour[-1], colour[:, 0], colour[:, -1]])
+        obj = np.sqrt(((colour - np.median(border, axis=0)) ** 2).sum(axis=2)) >= BG_DISTANCE
+    delta_e = np.sqrt(((_lab(output) - _lab(reference)) ** 2).sum(axis=2))
+    backdrop = ~obj & (source.shape[2] == 3)
+    shift = np.abs(output[..., :3].astype(np.float32) - reference[..., :3])[backdrop]
+    return float(delta_e[obj].mean()), float(shift.mean()) if shift.size else 0.0
+
+
+def cases():
+    ring, alpha = synthetic_ring(size=1024)
+    chain = np.full((900, 1228, 3), 255, np.uint8)
+    chain[:, ::3] = 0  # Fine vertical links, the worst case for sub-pixel shifts
+    chain[::5, :] = (40, 170, 215)
+    gold = np.full((800, 800, 3), 252, np.uint8)
+    cv2.circle(gold, (400, 400), 260, (32, 136, 172), -1)  # Flat gold piece on a white backdrop
+    cv2.circle(gold, (330, 330), 40, (120, 200, 235), -1)
+    light = np.full((800, 800, 3), 252, np.uint8)
+    for y in range(100, 700, 100):
+        cv2.line(light, (80, y), (720, y), (30, 120, 200), 12)  # Thin coloured line work, mostly white
+    return [
+        # (name, PNG, max side, colour checked); the chain's 1px stripes are a tiling
+        # stress test that sharpening rightly changes
+        ("ring crop 819px capped at 1310 (1.6x)", _png(ring[100:919, 100:919]), 1310, True),
+        ("chain crop 1228x900 capped at 2048 (1.67x)", _png(chain), 2048, False),
+        ("cut-out with alpha, 1024px at 2x", _png(np.dstack([ring, alpha])), 4096, True),
+        ("gold piece on white, 800px at 2x", _png(gold), 4096, True),
+        ("near-white line crop, 800px at 2x", _png(light), 4096, True),
+    ]
+
+
+def main():
+    mismatch = colour_shift = False
+    print(f"{'case':<46}{'tiled s':>9}{'single s':>10}{'max diff':>10}{'dE obj':>8}{'bg shift':>10}")
+    for name, data, max_side, check_colour in cases():
+        started = time.perf_counter()
+        tiled = _decode(enhance_image_bytes(data, max_side=max_side))
+        tiled_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        single = _decode(enhance_image_bytes(data, max_side=max_side, tile=1 << 20))
+        single_seconds = time.perf_counter() - started
+
+        diff = int(np.abs(tiled.astype(np.int16) - single.astype(np.int16)).max())
+        mismatch |= tiled.shape != single.shape or diff != 0
+        row = f"{name:<46}{tiled_seconds:>9.2f}{single_seconds:>10.2f}{diff:>10}"
+        if check_colour:
+            delta_e, shift = fidelity(_decode(data), tiled)
+            colour_shift |= delta_e > MAX_DELTA_E or shift > MAX_BACKDROP_SHIFT
+            row += f"{delta_e:>8.2f}{shift:>10.2f}"
+        print(row)
+
+    print(f"\nTILE={TILE}: " + ("MISMATCH - tiled output differs" if mismatch else "tiled output identical"))
+    print("colour: " + (f"SHIFTED - delta E above {MAX_DELTA_E} or backdrop moved" if colour_shift
+                         else "object and backdrop preserved"))
+    sys.exit(1 if mismatch or colour_shift else 0)
+
+
+if __name__ == "__main__":
+    main()
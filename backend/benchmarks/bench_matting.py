@@ -0,0 +1,169 @@
+"""
+Benchmark the fast white-background matte against rembg.
+
+Usage (from backend/):
+    python -m benchmarks.bench_matting                 # synthetic jewelry shots
+    python -m benchmarks.bench_matting path/to/images  # real generations too
+
+Synthetic images have an exact ground-truth alpha, so both methods are scored
+by mean absolute alpha error and foreground IoU. The highlight cases must
+keep the blown-out highlight opaque, or score low enough to fall back to rembg. For real images rembg is used
+as the reference. rembg is skipped when it is not installed.
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.matting import white_background_matte  # noqa: E402
+
+
+def synthetic_ring(size=1024, shadow=False):
+    """Gold ring with a gemstone and a highlight on white; returns (BGR, alpha)"""
+    scale = 4  # draw large then downsample for anti-aliased edges
+    big = size * scale
+    alpha = np.zeros((big, big), np.uint8)
+    center = (big // 2, big // 2 + big // 10)
+    cv2.circle(alpha, center, big // 4, 255, -1)
+    cv2.circle(alpha, center, big // 4 - big // 22, 0, -1)  # ring centre hole
+    gem_center = (big // 2, big // 2 - big // 6)
+    cv2.circle(alpha, gem_center, big // 12, 255, -1)
+
+    color = np.zeros((big, big, 3), np.uint8)
+    color[:] = (40, 170, 215)  # gold (BGR)
+    cv2.circle(color, gem_center, big // 12, (40, 20, 200), -1)  # ruby
+    cv2.circle(color, (gem_center[0] - big // 40, gem_center[1] - big // 40), big // 90, (255, 255, 255), -1)
+
+    alpha = cv2.resize(alpha, (size, size), interpolation=cv2.INTER_AREA)
+    color = cv2.resize(color, (size, size), interpolation=cv2.INTER_AREA)
+    background = np.full_like(color, 255)
+    if shadow:
+        shade = np.zeros((size, size), np.float32)
+        cv2.ellipse(shade, (size // 2, int(size * 0.88)), (size // 3, size // 20), 0, 0, 360, 1.0, -1)
+        shade = cv2.GaussianBlur(shade, (0, 0), size / 40)
+        background = (background * (1 - 0.35 * shade[..., None])).astype(np.uint8)
+
+    a = alpha.astype(np.float32)[..., None] / 255.0
+    image = (color * a + background * (1 - a)).astype(np.uint8)
+    return image, alpha
+
+
+def synthetic_chain(size=1024):
+    scale = 4
+    big = size * scale
+    alpha = np.zeros((big, big), np.uint8)
+    for i in range(14):
+        x = big // 8 + i * big // 18
+        y = big // 3 + int(np.sin(i / 2.0) * big / 12)
+        cv2.ellipse(alpha, (x, y), (big // 30, big // 50), (i % 2) * 90, 0, 360, 255, big // 150)
+    color = np.zeros((big, big, 3), np.uint8)
+    color[:] = (190, 190, 195)  # silver
+    alpha = cv2.resize(alpha, (size, size), interpolation=cv2.INTER_AREA)
+    color = cv2.resize(color, (size, size), interpolation=cv2.INTER_AREA)
+    a = alpha.astype(np.float32)[..., None] / 255.0
+    return (color * a + 255 * (1 - a)).astype(np.uint8), alpha
+
+
+def synthetic_highlight(size=1024, near_rim=False):
+    """Gold disc on white with a 60px blown-out highlight that must stay opaque"""
+    scale = 4
+    big = size * scale
+    center = (big // 2, big // 2)
+    radius = big * 3 // 10
+    alpha = np.zeros((big, big), np.uint8)
+    cv2.circle(alpha, center, radius, 255, -1)
+    color = np.zeros((big, big, 3), np.uint8)
+    color[:] = (32, 136, 172)  # gold (BGR)
+    # Inside the disc, or close enough to its rim that it could pass for a hole
+    offset = radius - 30 * scale - 24 * scale if near_rim else radius // 3
+    cv2.circle(color, (center[0] - offset, center[1]), 30 * scale, (255, 255, 255), -1)
+    alpha = cv2.resize(alpha, (size, size), interpolation=cv2.INTER_AREA)
+    color = cv2.resize(color, (size, size), interpolation=cv2.INTER_AREA)
+    a = alpha.astype(np.float32)[..., None] / 255.0
+    return (color * a + 255 * (1 - a)).astype(np.uint8), alpha
+
+
+def alpha_metrics(predicted, reference):
+    mae = float(np.abs(predicted.astype(np.float32) - reference.astype(np.float32)).mean() / 255.0)
+    p, r = predicted > 127, reference > 127
+    union = np.logical_or(p, r).sum()
+    iou = float(np.logical_and(p, r).sum() / union) if union else 1.0
+    return mae, iou
+
+
+def load_rembg():
+    try:
+        from rembg import new_session, remove
+    except ImportError:
+        return None
+    session = new_session()
+
+    def run(image):
+        ok, encoded = cv2.imencode(".png", image)
+        out = remove(encoded.tobytes(), session=session, alpha_matting=True,
+                     alpha_matting_foreground_threshold=240,
+                     alpha_matting_background_threshold=10,
+                     alpha_matting_erode_size=10)
+        return cv2.imdecode(np.frombuffer(out, np.uint8), cv2.IMREAD_UNCHANGED)[..., 3]
+    return run
+
+
+def timed(fn, *args, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    cases = [
+        ("ring", *synthetic_ring()),
+        ("ring+shadow", *synthetic_ring(shadow=True)),
+        ("chain", *synthetic_chain()),
+        ("blown highlight", *synthetic_highlight()),
+        ("highlight near rim", *synthetic_highlight(near_rim=True)),
+    ]
+    for directory in sys.argv[1:]:
+        for name in sorted(os.listdir(directory)):
+            image = cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                cases.append((name, image, None))
+
+    rembg = load_rembg()
+    if rembg is None:
+        print("rembg not installed - reporting the fast path only\n")
+
+    header = f"{'image':<24}{'fast ms':>9}{'score':>7}{'fast mae':>10}{'fast iou':>10}"
+    if rembg:
+        header += f"{'rembg ms':>10}{'rembg mae':>11}{'rembg iou':>11}"
+    print(header)
+
+    for name, image, truth in cases:
+        (alpha, score), fast_ms = timed(white_background_matte, image)
+        rembg_alpha, rembg_ms = (timed(rembg, image, repeat=1) if rembg else (None, None))
+        reference = truth if truth is not None else rembg_alpha
+
+        row = f"{name[:23]:<24}{fast_ms:>9.1f}{score:>7.2f}"
+        if reference is not None:
+            mae, iou = alpha_metrics(alpha, reference)
+            row += f"{mae:>10.4f}{iou:>10.3f}"
+        else:
+            row += f"{'-':>10}{'-':>10}"
+        if rembg:
+            if truth is not None:
+                mae, iou = alpha_metrics(rembg_alpha, truth)
+                row += f"{rembg_ms:>10.1f}{mae:>11.4f}{iou:>11.3f}"
+            else:
+                row += f"{rembg_ms:>10.1f}{'(ref)':>11}{'(ref)':>11}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
-from fastapi import FastAPI, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
@@ -6,17 +12,62 @@ from typing import List, Dict
 import uuid
 import asyncio
 import base64
-import httpx
+import json
 from dotenv import load_dotenv
-from rembg import remove
-from utils.image_generator import JewelryImageGenerator
-from utils.image_processor import ImageProcessor
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before utils read their settings)
 load_dotenv()
 
+from utils.image_generator import ENHANCE_MODE, JewelryImageGenerator
+from utils.image_processor import ImageProcessor
+from utils.matting import remove_background
+from utils.circuit_breaker import breaker_snapshot
+from utils.deadline import (
+    GENERATE_BUDGET_SECONDS,
+    MODIFY_BUDGET_SECONDS,
+    FINALIZE_BUDGET_SECONDS,
+    budget_left,
+    deadline_scope,
+    detached_context,
+    with_deadline,
+    within_deadline,
+)
+from utils.admission import AdmissionRejected, admission, capacity_prometheus, capacity_snapshot
+from utils.bulk import BULK_MAX_ITEMS, BulkJobManager
+from utils.encoding import negotiated_response
+from utils.http_pool import close_http_client
+from utils.local_enhancer import local_enhancer
+from utils.media import MEDIA_FETCH_TIMEOUT, media_mirror, media_url, valid_media_id
+from utils.loop_monitor import LOOP_MONITOR_ENABLED, LOOP_MONITOR_STRICT, LoopBlockedError, loop_monitor
+from utils.payload import payload_stats, payload_store
+from utils.pipeline import Pipeline, Stage, shutdown_pools, stage_stats
+from utils.versions import SessionHistory
+from utils.warmup import record_import, run_warmup, warmup_state
+
+record_import("main", time.perf_counter() - _import_started)
+
 
-app = FastAPI(title="AI Jewelry Generator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the worker answers /healthz immediately and
+    # reports ready on /readyz once models are loaded and a Seedream connection is open
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    # Index the mirror before anything can add to it: load() fills it from a thread
+    await asyncio.to_thread(media_mirror.load)
+    warmup_task = asyncio.create_task(run_warmup())
+    await bulk_jobs.resume()
+    yield
+    loop_monitor.stop()
+    warmup_task.cancel()
+    await close_http_client()
+    local_enhancer.shutdown()
+    shutdown_pools()
+    for task in idle_renders.values():
+        task.cancel()
+
+
+app = FastAPI(title="AI Jewelry Generator", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,11 +77,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if LOOP_MONITOR_STRICT:
+    @app.middleware("http")
+    async def fail_on_blocked_loop(request: Request, call_next):
+        """Debug mode: turn any request during which the event loop blocked into a 500"""
+        blocked_before = loop_monitor.blocked_total
+        response = await call_next(request)
+        await asyncio.sleep(loop_monitor.threshold)  # give the watchdog time to close out a stall
+        try:
+            loop_monitor.check(since=blocked_before)
+        except LoopBlockedError as e:
+            return PlainTextResponse(str(e), status_code=500)
+        return response
+
+@app.exception_handler(AdmissionRejected)
+async def reject_over_capacity(request: Request, exc: AdmissionRejected):
+    """Shed load fast instead of letting every request time out"""
+    return JSONResponse(
+        {"detail": str(exc), "retry_after": exc.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 image_generator = JewelryImageGenerator()
 image_processor = ImageProcessor()
 
 sessions = {}
 
+# Minimum request budget (seconds) left before /finalize attempts background removal
+REMBG_MIN_BUDGET_SECONDS = float(os.getenv("REMBG_MIN_BUDGET_SECONDS", "10"))
+# "batch": hero and detail views from one multi-output Seedream request, falling
+# back to "crop" (generate the base, then crop and enhance each region)
+DETAIL_VIEWS_MODE = os.getenv("DETAIL_VIEWS_MODE", "crop").lower()
+# Progressive resolution: /generate and /modify render at the preview size while
+# the user iterates; the final size is rendered at /finalize or once the session
+# has been idle for IDLE_RENDER_SECONDS (0 disables the background render)
+PREVIEW_SIZE = os.getenv("PREVIEW_SIZE", "1K")
+FINAL_SIZE = os.getenv("FINAL_SIZE", "2K")
+IDLE_RENDER_SECONDS = float(os.getenv("IDLE_RENDER_SECONDS", "120"))
+# Seconds of the /finalize budget the final render may use before sketching starts
+FINAL_RENDER_BUDGET_SECONDS = float(os.getenv("FINAL_RENDER_BUDGET_SECONDS", "60"))
+# Detail crops enhanced at once across all requests (pipeline "enhance" stage)
+ENHANCE_STAGE_CONCURRENCY = int(os.getenv("ENHANCE_STAGE_CONCURRENCY", "8"))
+# Images having their background removed at once across all /finalize requests
+CUTOUT_STAGE_CONCURRENCY = int(os.getenv("CUTOUT_STAGE_CONCURRENCY", "2"))
+TIER_SIZES = {"preview": PREVIEW_SIZE, "final": FINAL_SIZE}
+PREVIEW_TIER = "preview" if PREVIEW_SIZE != FINAL_SIZE else "final"
+
+DETAIL_ENHANCEMENT_PROMPT = "Enhance this cropped jewelry image to ultra-high resolution. Keep the exact same design, shape, proportions, and metal texture as in the input image. Do not modify, redraw, or hallucinate any new parts. Simply upscale and refine for realistic clarity, sharpness, and lighting. Maintain identical gemstone color, chain thickness, reflections, and polished metal finish. Treat this as a photo enhancement task, not generation. Output must look like the same jewelry captured with a macro camera on a white or transparent background."
+FINAL_RENDER_PROMPT = "Re-render this exact jewelry image at higher resolution. Keep the EXACT SAME design, shape, proportions, materials, gemstone colors, camera angle, lighting and white background. Do not modify, redraw, or add anything. Only increase resolution, clarity and fine metal and gemstone detail."
+
 class GenerateRequest(BaseModel):
     prompt: str
 
@@ -44,81 +140,413 @@ class ModifyRequest(BaseModel):
 class FinalizeRequest(BaseModel):
     session_id: str
 
+class BulkGenerateRequest(BaseModel):
+    prompts: List[str]
+
 @app.get("/")
 async def root():
     return {"message": "AI Jewelry Generator API", "status": "running"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: warm-up has finished, so the worker can take traffic"""
+    report = warmup_state.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/health")
+async def health():
+    """Upstream circuit breaker state; 'degraded' while any breaker is not closed"""
+    breakers = breaker_snapshot()
+    degraded = any(b["state"] != "closed" for b in breakers.values())
+    return {"status": "degraded" if degraded else "ok", "breakers": breakers, "event_loop": loop_monitor.snapshot()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: event-loop lag histogram, blocked callbacks and admission gauges"""
+    return PlainTextResponse(loop_monitor.prometheus() + capacity_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/capacity")
+async def capacity():
+    """In-flight work, queue depth and estimated wait per endpoint, for the autoscaler"""
+    return capacity_snapshot()
+
+@app.get("/payloads/{payload_id}")
+async def get_payload(payload_id: str):
+    """Minimized image inputs handed to Seedream by URL (see PUBLIC_BASE_URL)"""
+    item = payload_store.get(payload_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Payload not found or expired")
+    mime, data = item
+    return Response(content=data, media_type=mime, headers={"Cache-Control": "private, max-age=600"})
+
+@app.get("/media/{media_id}")
+async def get_media(media_id: str, request: Request):
+    """
+    Mirrored copy of an upstream image, streamed from disk in chunks.
+
+    Waits for a download still in flight. Mirrored images never change, so
+    clients revalidate with If-None-Match (304) and may cache indefinitely;
+    Range requests are honoured.
+    """
+    if not valid_media_id(media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    entry = await media_mirror.entry(media_id, timeout=MEDIA_FETCH_TIMEOUT)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Media not found or not mirrored")
+    headers = {"ETag": entry["etag"], "Cache-Control": "public, max-age=31536000, immutable"}
+    client_tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if entry["etag"] in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(media_mirror.path(media_id), media_type=entry["mime"], headers=headers)
+
+@app.get("/stats/media")
+async def get_media_stats():
+    """Upstream images mirrored to local disk"""
+    return media_mirror.stats()
+
+@app.get("/stats/payloads")
+async def get_payload_stats():
+    """Bytes saved by minimizing image-to-image inputs"""
+    return payload_stats.report()
+
+@app.get("/stats/pipelines")
+async def get_pipeline_stats():
+    """Wall time per pipeline stage (and memo hits for memoized stages)"""
+    return stage_stats.report([generate_pipeline, restyle_pipeline, finalize_pipeline])
+
+async def batched_views(prompt: str, jewelry_type: str, size: str, image_url: str = None):
+    """
+    Hero view and detail views from one multi-output Seedream request.
+
+    Returns (base_url, details). Either may be None: no base means batching is
+    unavailable, no details means the set came back short and the caller
+    should crop and enhance the base instead.
+    """
+    regions = list(image_processor.detail_regions(jewelry_type))
+    views = await image_generator.generate_view_set(prompt, regions, size=size, image_url=image_url)
+    if not views:
+        return None, None
+    if len(views) < 1 + len(regions):
+        print(f"Batch returned {len(views)}/{1 + len(regions)} views, cropping details from the base view")
+        return views[0], None
+    details = [{"angle": f"{name} detail", "url": url} for name, url in zip(regions, views[1:])]
+    return views[0], details
+
+def tag_tier(images: List[dict], tier: str) -> List[dict]:
+    """Record which resolution tier ("preview" or "final") each image was rendered at"""
+    return [{**image, "tier": tier} for image in images]
+
+# Design pipeline stages: base view -> crop -> enhance -> assemble. /generate
+# starts from text, /modify and the final render restyle an existing base view.
+
+async def stage_batched_views(base_prompt: str, jewelry_type: str, size: str, source_image) -> tuple:
+    if DETAIL_VIEWS_MODE != "batch":
+        return None, None
+    return await batched_views(base_prompt, jewelry_type, size, image_url=source_image)
+
+async def stage_generate_base(base_prompt: str, size: str, batched: tuple) -> str:
+    if batched[0]:
+        return batched[0]
+    print(f"Generating base image in {size} resolution...")
+    base_image_url = await image_generator.generate_image(base_prompt, size=size)
+    print(f"Base image generated: {base_image_url}")
+    return base_image_url
+
+async def stage_restyle_base(base_prompt: str, size: str, batched: tuple, source_image: str) -> str:
+    # Image-to-image keeps the exact design, shape and structure of the source
+    if batched[0]:
+        return batched[0]
+    print(f"Restyling existing jewelry (image-to-image) at {size}...")
+    base_image_url = await image_generator.enhance_image(source_image, base_prompt, size=size)
+    print(f"Restyled base image generated: {base_image_url}")
+    return base_image_url
+
+async def stage_crop(base_image_url: str, jewelry_type: str, batched: tuple) -> dict:
+    if batched[1] is not None:
+        return {}  # Details came with the batched views
+    print(f"Cropping jewelry regions...")
+    cropped_regions = await image_processor.crop_jewelry_regions(base_image_url, jewelry_type)
+    print(f"Cropped {len(cropped_regions)} regions: {list(cropped_regions.keys())}")
+    return cropped_regions
+
+async def stage_composite(cropped_regions: dict, enhancement_prompt: str, size: str) -> dict:
+    if ENHANCE_MODE != "composite" or not cropped_regions:
+        return {}
+    enhanced = await within_deadline(
+        image_generator.enhance_crops_composite(cropped_regions, enhancement_prompt, size=size),
+        fallback=None
+    )
+    return enhanced or {}
+
+async def stage_enhance_region(region_name: str, crop: str, composite_details: dict,
+                               enhancement_prompt: str, size: str) -> dict:
+    if region_name in composite_details:
+        return {"angle": f"{region_name} detail", "url": composite_details[region_name]}
+    try:
+        # If the request budget runs out, degrade to the raw crop instead of waiting
+        enhanced_url = await within_deadline(
+            image_generator.enhance_crop(crop, enhancement_prompt, size=size),
+            fallback=crop
+        )
+    except Exception as e:
+        print(f"Error enhancing {region_name}: {e}")
+        enhanced_url = crop  # Fallback to cropped version
+    return {"angle": f"{region_name} detail", "url": enhanced_url}
+
+def stage_assemble(base_image_url: str, batched: tuple, enhanced_regions: dict, tier: str) -> list:
+    details = batched[1] if batched[1] is not None else list(enhanced_regions.values())
+    return tag_tier([{"angle": "base view", "url": base_image_url}] + details, tier)
+
+def _design_pipeline(name: str, base_stage: Stage) -> Pipeline:
+    return Pipeline(name, [
+        Stage("views", stage_batched_views,
+              {"base_prompt": str, "jewelry_type": str, "size": str, "source_image": (str, type(None))},
+              output="batched", output_type=tuple),
+        base_stage,
+        Stage("crop", stage_crop, {"base_image_url": str, "jewelry_type": str, "batched": tuple},
+              output="cropped_regions", output_type=dict, memoize=bool),
+        Stage("composite", stage_composite, {"cropped_regions": dict, "enhancement_prompt": str, "size": str},
+              output="composite_details", output_type=dict),
+        Stage("enhance", stage_enhance_region,
+              {"cropped_regions": dict, "composite_details": dict, "enhancement_prompt": str, "size": str},
+              output="enhanced_regions", output_type=dict, map_over="cropped_regions",
+              concurrency=ENHANCE_STAGE_CONCURRENCY),
+        Stage("assemble", stage_assemble,
+              {"base_image_url": str, "batched": tuple, "enhanced_regions": dict, "tier": str},
+              output="images", output_type=list, executor="inline"),
+    ])
+
+generate_pipeline = _design_pipeline("generate", Stage(
+    "base", stage_generate_base, {"base_prompt": str, "size": str, "batched": tuple},
+    output="base_image_url", output_type=str))
+restyle_pipeline = _design_pipeline("restyle", Stage(
+    "base", stage_restyle_base, {"base_prompt": str, "size": str, "batched": tuple, "source_image": str},
+    output="base_image_url", output_type=str))
+
+async def render_final_tier(session_id: str) -> bool:
+    """
+    Re-render a preview-tier session at FINAL_SIZE and record it as a new version.
+
+    The final base view is an image-to-image re-render of the preview and the
+    details are cropped from it again. Nothing is recorded if the user moved to
+    another version meanwhile or the re-render failed. Returns True if rendered.
+    """
+    session = sessions[session_id]
+    if all(image.get("tier") == "final" for image in session["images"]):
+        return False
+    started_version = session["history"].current["version"]
+    preview_base = session["images"][0]["url"]
+    
+    if not image_generator.has_api_key:
+        return False  # Nothing can be re-rendered without Seedream
+    
+    print(f"Rendering session {session_id} at {FINAL_SIZE}...")
+    result = await restyle_pipeline.run(
+        base_prompt=FINAL_RENDER_PROMPT,
+        source_image=preview_base,
+        jewelry_type=session["original_prompt"].lower(),
+        enhancement_prompt=DETAIL_ENHANCEMENT_PROMPT,
+        size=FINAL_SIZE,
+        tier="final"
+    )
+    if result["base_image_url"] == preview_base:
+        return False  # Upstream failure; keep the preview
+    
+    if session["history"].current["version"] != started_version:
+        print(f"Session {session_id} changed during final render, discarding it")
+        return False
+    images = result["images"]
+    session["images"] = images
+    session["history"].commit(images, session, label="final render")
+    return True
+
+idle_renders: Dict[str, asyncio.Task] = {}
+rendering_sessions = set()
+
+def schedule_idle_render(session_id: str):
+    """(Re)start the idle timer after which the session is rendered at the final tier"""
+    if IDLE_RENDER_SECONDS <= 0 or PREVIEW_TIER == "final":
+        return
+    previous = idle_renders.pop(session_id, None)
+    if previous is not None:
+        previous.cancel()
+    # Detached from the request's deadline, which has long expired when the timer fires
+    idle_renders[session_id] = asyncio.create_task(_render_when_idle(session_id), context=detached_context())
+
+async def _render_when_idle(session_id: str):
+    await asyncio.sleep(IDLE_RENDER_SECONDS)
+    rendering_sessions.add(session_id)
+    try:
+        with deadline_scope(FINALIZE_BUDGET_SECONDS):
+            await render_final_tier(session_id)
+    except Exception as e:
+        print(f"Background final render failed for {session_id}: {e}")
+    finally:
+        rendering_sessions.discard(session_id)
+        if idle_renders.get(session_id) is asyncio.current_task():
+            del idle_renders[session_id]
+
+async def ensure_final_tier(session_id: str):
+    """Bring a session to the final tier within the request budget, reusing a background render in flight"""
+    task = idle_renders.pop(session_id, None)
+    if task is not None and session_id in rendering_sessions:
+        await within_deadline(asyncio.shield(task), fallback=None)
+        return
+    if task is not None:
+        task.cancel()
+    await within_deadline(render_final_tier(session_id), fallback=False)
+
 @app.post("/generate")
-async def generate_jewelry(request: GenerateRequest):
+@admission("generate")
+@with_deadline(GENERATE_BUDGET_SECONDS)
+async def generate_jewelry(request: GenerateRequest, http_request: Request):
     try:
-        import asyncio
-        session_id = str(uuid.uuid4())
-        
-        # Step 1: Generate ONE ultra-high-resolution base image (2K)
-        base_prompt = f"ONLY ONE jewelry item: {request.prompt}, EXACTLY ONE single piece ONLY, NO other jewelry, NO rings unless specified, NO extra objects, centered professional product photography, single isolated jewelry item on PLAIN WHITE BACKGROUND, NO scenery, NO water, NO ocean, NO sky, NO flowers, NO props, NO background elements, ultra-high resolution, studio lighting, perfect clarity, best quality"
-        
-        print(f"Generating base image in 2K resolution...")
-        base_image_url = await image_generator.generate_image(base_prompt, size="2K")
-        print(f"Base image generated: {base_image_url}")
-        
-        # Step 2: Crop regions from the base image
-        print(f"Cropping jewelry regions...")
-        jewelry_type = request.prompt.lower()
-        cropped_regions = await image_processor.crop_jewelry_regions(base_image_url, jewelry_type)
-        print(f"Cropped {len(cropped_regions)} regions: {list(cropped_regions.keys())}")
-        
-        # Step 3: Enhance each cropped region using image-to-image
-        enhancement_prompt = "Enhance this cropped jewelry image to ultra-high resolution. Keep the exact same design, shape, proportions, and metal texture as in the input image. Do not modify, redraw, or hallucinate any new parts. Simply upscale and refine for realistic clarity, sharpness, and lighting. Maintain identical gemstone color, chain thickness, reflections, and polished metal finish. Treat this as a photo enhancement task, not generation. Output must look like the same jewelry captured with a macro camera on a white or transparent background."
-        
-        print(f"Enhancing cropped regions...")
-        enhanced_details = []
-        
-        # Enhance crops in parallel
-        async def enhance_region(region_name: str, crop_data: str) -> dict:
-            try:
-                enhanced_url = await image_generator.enhance_image(crop_data, enhancement_prompt)
-                return {
-                    "angle": f"{region_name} detail",
-                    "url": enhanced_url
-                }
-            except Exception as e:
-                print(f"Error enhancing {region_name}: {e}")
-                return {
-                    "angle": f"{region_name} detail",
-                    "url": crop_data  # Fallback to cropped version
-                }
-        
-        enhancement_tasks = [enhance_region(name, crop) for name, crop in cropped_regions.items()]
-        enhanced_details = await asyncio.gather(*enhancement_tasks)
-        print(f"Enhanced {len(enhanced_details)} detail crops")
-        
-        # Step 4: Combine base image + enhanced detail crops
-        images = [
-            {"angle": "base view", "url": base_image_url}
-        ] + enhanced_details
-        
-        sessions[session_id] = {
-            "original_prompt": request.prompt,
-            "images": images,
-            "base_image": base_image_url,
-            "metal": "gold",
-            "gemstone": "ruby",
-            "band_shape": "thin"
-        }
-        
-        return {
-            "session_id": session_id,
-            "images": images
-        }
+        design = await create_design(request.prompt)
+        schedule_idle_render(design["session_id"])
+        return await negotiated_response(http_request, design)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+async def render_design(prompt: str, tier: str) -> dict:
+    """Run the generate graph: a base image plus enhanced detail crops (no session)"""
+    size = TIER_SIZES[tier]
+    
+    # Generate ONE base image (1K preview while iterating, 2K final), then crop and enhance details
+    base_prompt = f"ONLY ONE jewelry item: {prompt}, EXACTLY ONE single piece ONLY, NO other jewelry, NO rings unless specified, NO extra objects, centered professional product photography, single isolated jewelry item on PLAIN WHITE BACKGROUND, NO scenery, NO water, NO ocean, NO sky, NO flowers, NO props, NO background elements, ultra-high resolution, studio lighting, perfect clarity, best quality"
+    
+    result = await generate_pipeline.run(
+        base_prompt=base_prompt,
+        source_image=None,
+        jewelry_type=prompt.lower(),
+        enhancement_prompt=DETAIL_ENHANCEMENT_PROMPT,
+        size=size,
+        tier=tier
+    )
+    return {"images": result["images"], "base_image": result["base_image_url"]}
+
+async def create_design(prompt: str, tier: str = PREVIEW_TIER) -> dict:
+    """Generate a base image plus enhanced detail crops and open a session for it"""
+    session_id = str(uuid.uuid4())
+    design = await render_design(prompt, tier)
+    images = design["images"]
+    base_image_url = design["base_image"]
+    
+    sessions[session_id] = {
+        "original_prompt": prompt,
+        "images": images,
+        "base_image": base_image_url,
+        "metal": "gold",
+        "gemstone": "ruby",
+        "band_shape": "thin",
+        "history": SessionHistory()
+    }
+    version = sessions[session_id]["history"].commit(images, sessions[session_id], label="generate")
+    
+    return {
+        "session_id": session_id,
+        "images": media_mirror.public_images(images),
+        "version": version["version"]
+    }
+
+async def _catalog_image(image: dict) -> dict:
+    """
+    Reference to a catalog image kept on disk: inline crops are written to the
+    media store and upstream images keep their mirror copy, both pinned so the
+    links outlive the upstream's signed URLs
+    """
+    url = image["url"]
+    if url.startswith("data:"):
+        header, data = url.split(",", 1)
+        media_id = await media_mirror.store(base64.b64decode(data), header[5:].split(";")[0], pinned=True)
+    elif media_mirror.known(url) and await media_mirror.pin(media_mirror.key(url)):
+        media_id = media_mirror.key(url)
+    else:
+        return image
+    return dict(image, url=media_url(media_id), media_id=media_id)
+
+async def generate_bulk_item(prompt: str) -> dict:
+    """
+    One catalog item: a full design under its own /generate budget.
+
+    No interactive session is opened, and the record holds /media references
+    rather than inline images, so a 1000-item job stays small in memory and
+    in its results.jsonl checkpoint.
+    """
+    with deadline_scope(GENERATE_BUDGET_SECONDS):
+        design = await render_design(prompt, tier="final")  # Catalog output is the deliverable
+    if "via.placeholder.com" in design["base_image"]:
+        raise RuntimeError("Base image generation failed")  # Retried by the job manager
+    return {"images": [await _catalog_image(image) for image in design["images"]]}
+
+bulk_jobs = BulkJobManager(generate_bulk_item)
+
+async def _start_bulk_job(prompts: List[str]) -> dict:
+    prompts = [p.strip() for p in prompts if p and p.strip()]
+    if not prompts:
+        raise HTTPException(status_code=400, detail="No prompts given")
+    if len(prompts) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} prompts per job")
+    job = await bulk_jobs.create_job(prompts)
+    return {
+        "job_id": job.job_id,
+        "total": len(prompts),
+        "status_url": f"/bulk/{job.job_id}",
+        "stream_url": f"/bulk/{job.job_id}/stream"
+    }
+
+@app.post("/bulk/generate")
+async def bulk_generate(request: BulkGenerateRequest):
+    return await _start_bulk_job(request.prompts)
+
+@app.post("/bulk/generate/upload")
+async def bulk_generate_upload(file: UploadFile = File(...)):
+    """JSONL upload: one prompt per line, as a JSON string or {"prompt": ...}"""
+    prompts = []
+    content = (await file.read()).decode("utf-8")
+    for line_number, line in enumerate(content.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail=f"Line {line_number} is not valid JSON")
+        prompt = item.get("prompt") if isinstance(item, dict) else item
+        if not isinstance(prompt, str):
+            raise HTTPException(status_code=400, detail=f"Line {line_number} has no prompt")
+        prompts.append(prompt)
+    return await _start_bulk_job(prompts)
+
+@app.get("/bulk/{job_id}")
+async def bulk_status(job_id: str, include_items: bool = False):
+    job = bulk_jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    status = job.summary()
+    if include_items:
+        status["items"] = [job.results[i] for i in sorted(job.results)]
+    return status
+
+@app.get("/bulk/{job_id}/stream")
+async def bulk_stream(job_id: str):
+    """NDJSON stream of item results as they finish, ending with the job summary"""
+    job = bulk_jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return StreamingResponse(bulk_jobs.stream(job), media_type="application/x-ndjson")
+
 @app.post("/modify")
-async def modify_jewelry(request: ModifyRequest):
+@admission("modify")
+@with_deadline(MODIFY_BUDGET_SECONDS)
+async def modify_jewelry(request: ModifyRequest, http_request: Request):
     try:
-        import asyncio
         if request.session_id not in sessions:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -130,130 +558,180 @@ async def modify_jewelry(request: ModifyRequest):
         # Get the original base image from the session
         original_base_image = session["images"][0]["url"]
         
-        # Step 1: Use image-to-image to MODIFY the existing jewelry (NOT create new one)
+        # Use image-to-image to MODIFY the existing jewelry (NOT create new one)
         # This preserves the exact design, shape, and structure - only changes materials
         if request.custom_instruction:
             modification_prompt = f"Modify this jewelry according to these instructions: {request.custom_instruction}. CRITICAL: Keep the EXACT SAME design, shape, structure, proportions, and geometry as the input image. DO NOT change the jewelry type. DO NOT redesign. Maintain the same camera angle, lighting, and white background. This is a material/style swap only - preserve all design elements perfectly."
         else:
             modification_prompt = f"Transform this jewelry to {request.metal} metal with {request.gemstone} gemstone and {request.band_shape} band. CRITICAL: Keep the EXACT SAME design, shape, structure, proportions, and geometry as the input image. DO NOT change the jewelry type (necklace stays necklace, ring stays ring, etc). DO NOT redesign or create different jewelry. ONLY update the metal finish to {request.metal} color/texture and gemstone to {request.gemstone} color. The band should be {request.band_shape}. Maintain the same camera angle, lighting, and white background. This is a material swap only - preserve all design elements perfectly."
         
-        print(f"Modifying materials on existing jewelry (image-to-image)...")
-        base_image_url = await image_generator.enhance_image(original_base_image, modification_prompt)
-        print(f"Modified base image generated: {base_image_url}")
-        
-        # Step 2: Crop regions from the base image
-        print(f"Cropping jewelry regions from modified base...")
-        jewelry_type = session['original_prompt'].lower()
-        cropped_regions = await image_processor.crop_jewelry_regions(base_image_url, jewelry_type)
-        print(f"Cropped {len(cropped_regions)} regions: {list(cropped_regions.keys())}")
-        
-        # Step 3: Enhance each cropped region
         enhancement_prompt = f"Enhance this {request.metal} jewelry with {request.gemstone} to ultra-high resolution. Keep the exact same design, shape, proportions, and metal texture as in the input image. Do not modify, redraw, or hallucinate any new parts. Simply upscale and refine for realistic clarity, sharpness, and lighting. Maintain the {request.metal} metal finish and {request.gemstone} gemstone color. Treat this as a photo enhancement task. Output must look like the same jewelry captured with a macro camera on a white or transparent background."
         
-        print(f"Enhancing modified cropped regions...")
-        
-        async def enhance_region(region_name: str, crop_data: str) -> dict:
-            try:
-                enhanced_url = await image_generator.enhance_image(crop_data, enhancement_prompt)
-                return {
-                    "angle": f"{region_name} detail",
-                    "url": enhanced_url
-                }
-            except Exception as e:
-                print(f"Error enhancing {region_name}: {e}")
-                return {
-                    "angle": f"{region_name} detail",
-                    "url": crop_data
-                }
-        
-        enhancement_tasks = [enhance_region(name, crop) for name, crop in cropped_regions.items()]
-        enhanced_details = await asyncio.gather(*enhancement_tasks)
-        print(f"Enhanced {len(enhanced_details)} detail crops")
-        
-        # Step 4: Combine base image + enhanced detail crops
-        images = [
-            {"angle": "base view", "url": base_image_url}
-        ] + enhanced_details
+        result = await restyle_pipeline.run(
+            base_prompt=modification_prompt,
+            source_image=original_base_image,
+            jewelry_type=session['original_prompt'].lower(),
+            enhancement_prompt=enhancement_prompt,
+            size=TIER_SIZES[PREVIEW_TIER],
+            tier=PREVIEW_TIER
+        )
+        images = result["images"]
         
         session["images"] = images
+        version = session["history"].commit(images, session, label="modify")
+        schedule_idle_render(request.session_id)
         
-        return {
+        return await negotiated_response(http_request, {
             "session_id": request.session_id,
-            "images": images
-        }
+            "images": media_mirror.public_images(images),
+            "version": version["version"]
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _get_history(session_id: str) -> SessionHistory:
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return sessions[session_id]["history"]
+
+def _restore_version(session_id: str, version: dict) -> dict:
+    """Point the session at a stored version; no upstream calls"""
+    session = sessions[session_id]
+    history = session["history"]
+    images = history.images(version)
+    session["images"] = images
+    session.update(version["fields"])
+    return {
+        "session_id": session_id,
+        "images": media_mirror.public_images(images),
+        "version": version["version"],
+        "can_undo": history.position > 0,
+        "can_redo": history.position < len(history.versions) - 1
+    }
+
+@app.get("/sessions/{session_id}/versions")
+async def list_versions(session_id: str):
+    return {"session_id": session_id, **_get_history(session_id).summary()}
+
+@app.post("/sessions/{session_id}/undo")
+async def undo_version(session_id: str):
+    version = _get_history(session_id).undo()
+    if version is None:
+        raise HTTPException(status_code=409, detail="Nothing to undo")
+    return _restore_version(session_id, version)
+
+@app.post("/sessions/{session_id}/redo")
+async def redo_version(session_id: str):
+    version = _get_history(session_id).redo()
+    if version is None:
+        raise HTTPException(status_code=409, detail="Nothing to redo")
+    return _restore_version(session_id, version)
+
+@app.post("/sessions/{session_id}/versions/{version_number}")
+async def jump_to_version(session_id: str, version_number: int):
+    version = _get_history(session_id).jump(version_number)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Version not found (never created or dropped from history)")
+    return _restore_version(session_id, version)
+
+# Finalize pipeline: the final render feeds two independent branches, so the
+# originals' background removal overlaps with sketch conversion.
+
+async def stage_final_render(session_id: str) -> list:
+    # Committing the design: bring preview-tier images up to the final resolution
+    with deadline_scope(FINAL_RENDER_BUDGET_SECONDS):
+        await ensure_final_tier(session_id)
+    return sessions[session_id]["images"]
+
+async def stage_sketch(images: list) -> list:
+    # Convert the finalized jewelry images to pencil sketches using image-to-image
+    print(f"Converting {len(images)} finalized jewelry images to pencil sketches...")
+    sketches = await image_processor.convert_images_to_sketches(images)
+    print(f"Sketch conversion complete")
+    return sketches
+
+async def stage_fetch_image(index: int, image: dict):
+    """Download a remote image for the AR payload; None keeps inline (data:) images as they are"""
+    if image["url"].startswith("data:"):
+        return None
+    try:
+        _, data = await media_mirror.read(image["url"])  # Usually mirrored when it was generated
+        return data
+    except Exception as e:
+        print(f"Failed to convert {image['angle']}: {e}")
+    return None
+
+async def stage_cutout(index: int, image_bytes):
+    """Remove the background for AR transparency; None when skipped or failed"""
+    if image_bytes is None:
+        return None
+    # Skipped when the request is nearly out of budget
+    if not budget_left(REMBG_MIN_BUDGET_SECONDS):
+        print(f"Skipping background removal for image {index} (request budget low)")
+        return None
+    try:
+        print(f"Removing background for image {index}...")
+        # Fast white-background matte; rembg only for hard cases
+        no_bg_data = await within_deadline(
+            asyncio.to_thread(remove_background, image_bytes),
+            fallback=b""
+        )
+        if len(no_bg_data) > 100:
+            print(f"Background removed for image {index}")
+            return no_bg_data
+        print(f"Background removal failed (empty), keeping original")
+    except Exception as e:
+        print(f"Background removal error: {e}")
+    return None
+
+def _encode_for_ar(image: dict, data) -> dict:
+    if data is None:
+        return image
+    return {
+        "url": f"data:image/png;base64,{base64.b64encode(data).decode('utf-8')}",
+        "angle": image["angle"]
+    }
+
+def stage_encode_original(index: int, cutout, image_bytes: list, images: list) -> dict:
+    return _encode_for_ar(images[index], cutout if cutout is not None else image_bytes[index])
+
+def stage_encode_sketch(index: int, data, sketches: list) -> dict:
+    return _encode_for_ar(sketches[index], data)
+
+finalize_pipeline = Pipeline("finalize", [
+    Stage("render", stage_final_render, {"session_id": str}, output="images", output_type=list),
+    Stage("sketch", stage_sketch, {"images": list}, output="sketches", output_type=list),
+    Stage("fetch", stage_fetch_image, {"images": list},
+          output="image_bytes", output_type=list, map_over="images"),
+    Stage("cutout", stage_cutout, {"image_bytes": list},
+          output="cutouts", output_type=list, map_over="image_bytes",
+          concurrency=CUTOUT_STAGE_CONCURRENCY, memoize=bool),
+    # Encoding multi-megabyte images would stall the event loop
+    Stage("encode", stage_encode_original, {"cutouts": list, "image_bytes": list, "images": list},
+          output="original_images", output_type=list, map_over="cutouts", executor="thread"),
+    Stage("fetch_sketches", stage_fetch_image, {"sketches": list},
+          output="sketch_bytes", output_type=list, map_over="sketches"),
+    Stage("encode_sketches", stage_encode_sketch, {"sketch_bytes": list, "sketches": list},
+          output="sketches_for_ar", output_type=list, map_over="sketch_bytes", executor="thread"),
+])
+
 @app.post("/finalize")
-async def finalize_jewelry(request: FinalizeRequest):
+@admission("finalize")
+@with_deadline(FINALIZE_BUDGET_SECONDS)
+async def finalize_jewelry(request: FinalizeRequest, http_request: Request):
     try:
         if request.session_id not in sessions:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        session = sessions[request.session_id]
-        
-        # Convert the finalized jewelry images to pencil sketches using image-to-image
-        print(f"Converting {len(session['images'])} finalized jewelry images to pencil sketches...")
-        sketches = await image_processor.convert_images_to_sketches(session["images"])
-        print(f"Sketch conversion complete")
-        
-        async def convert_to_base64(img_dict, client, apply_rembg=True):
-            """Convert a single image dict to base64 if it's a remote URL"""
-            if img_dict["url"].startswith("data:"):
-                return img_dict
-            else:
-                try:
-                    response = await client.get(img_dict["url"], timeout=30.0)
-                    if response.status_code == 200:
-                        original_data = response.content
-                        img_data = original_data
-                        
-                        # Remove background for AR transparency (only for non-sketches)
-                        if apply_rembg:
-                            try:
-                                print(f"Removing background for {img_dict['angle']}...")
-                                # Enable alpha matting for better edge detection
-                                no_bg_data = await asyncio.to_thread(
-                                    remove, 
-                                    original_data, 
-                                    alpha_matting=True,
-                                    alpha_matting_foreground_threshold=240,
-                                    alpha_matting_background_threshold=10,
-                                    alpha_matting_erode_size=10
-                                )
-                                
-                                if len(no_bg_data) > 100:
-                                    img_data = no_bg_data
-                                    print(f"Background removed for {img_dict['angle']}")
-                                else:
-                                    print(f"Background removal failed (empty), keeping original")
-                            except Exception as e:
-                                print(f"Background removal error: {e}")
-                        
-                        base64_data = base64.b64encode(img_data).decode('utf-8')
-                        return {
-                            "url": f"data:image/png;base64,{base64_data}",
-                            "angle": img_dict["angle"]
-                        }
-                    else:
-                        return img_dict
-                except Exception as e:
-                    print(f"Failed to convert {img_dict['angle']}: {e}")
-                    return img_dict
-        
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            images_tasks = [convert_to_base64(img, client, apply_rembg=True) for img in session["images"]]
-            sketches_tasks = [convert_to_base64(sketch, client, apply_rembg=False) for sketch in sketches]
-            
-            images_for_ar = await asyncio.gather(*images_tasks)
-            sketches_for_ar = await asyncio.gather(*sketches_tasks)
+        result = await finalize_pipeline.run(session_id=request.session_id)
         
-        return {
+        # Megabytes of base64: encoded once (orjson, compressed or multipart), not via jsonable_encoder
+        return await negotiated_response(http_request, {
             "session_id": request.session_id,
-            "original_images": images_for_ar,
-            "sketches": sketches_for_ar,
-            "prompt": session.get("original_prompt", "")
-        }
+            "original_images": media_mirror.public_images(result["original_images"]),
+            "sketches": media_mirror.public_images(result["sketches_for_ar"]),
+            "prompt": sessions[request.session_id].get("original_prompt", "")
+        })
     except Exception as e:
         import traceback
         traceback.print_exc()
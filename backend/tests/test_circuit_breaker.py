@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from utils import circuit_breaker, seedream_client
+from utils.circuit_breaker import CLOSED, HALF_OPEN, CircuitBreaker
+
+
+def _half_open(name):
+    breaker = circuit_breaker.breaker_for("test", name)
+    breaker.state = HALF_OPEN
+    breaker.probe_leases.clear()
+    return breaker
+
+
+def test_cancelled_while_preparing_payload_holds_no_probe(monkeypatch):
+    breaker = _half_open("prepare")
+    monkeypatch.setattr(seedream_client, "breaker_for", lambda upstream, endpoint: breaker)
+    monkeypatch.setattr(seedream_client, "PAYLOAD_MINIMIZE", True)
+
+    def slow_minimize(image, size):
+        time.sleep(0.2)
+        return image
+
+    monkeypatch.setattr(seedream_client, "minimize_data_url", slow_minimize)
+
+    async def scenario():
+        client = seedream_client.SeedreamClient()
+        task = asyncio.create_task(client.generate({"image": "data:image/png;base64,AAAA"}, endpoint="prepare"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker.probes_in_flight == 0
+    assert breaker.allow_request()
+
+
+def test_cancelled_call_releases_its_probe(monkeypatch):
+    breaker = _half_open("post")
+    monkeypatch.setattr(seedream_client, "breaker_for", lambda upstream, endpoint: breaker)
+
+    async def slow_post(self, body, endpoint, timeout):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(seedream_client.SeedreamClient, "_post", slow_post)
+
+    async def scenario():
+        task = asyncio.create_task(seedream_client.SeedreamClient().generate({"prompt": "ring"}, endpoint="post"))
+        await asyncio.sleep(0.05)
+        assert breaker.probes_in_flight == 1
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(scenario())
+    assert breaker.probes_in_flight == 0
+
+
+def test_leaked_probe_expires_after_its_lease(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "BREAKER_PROBE_LEASE_SECONDS", 0.05)
+    breaker = CircuitBreaker("lease")
+    breaker.state = HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    assert breaker.would_reject()
+
+    time.sleep(0.06)
+    assert not breaker.would_reject()
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
@@ -0,0 +1,31 @@
+import asyncio
+
+import main
+from utils.deadline import FINALIZE_BUDGET_SECONDS, current_deadline, deadline_scope
+
+
+def test_idle_render_gets_its_own_budget_after_the_request_expired(monkeypatch):
+    monkeypatch.setattr(main, "IDLE_RENDER_SECONDS", 0.2)
+    monkeypatch.setattr(main, "PREVIEW_TIER", "preview")
+    budgets = []
+
+    async def fake_render(session_id):
+        budgets.append((session_id, current_deadline().budget, current_deadline().remaining()))
+        return True
+
+    monkeypatch.setattr(main, "render_final_tier", fake_render)
+
+    async def scenario():
+        with deadline_scope(0.05):  # The /generate request's budget
+            main.schedule_idle_render("session-1")
+            task = main.idle_renders["session-1"]
+        await task
+
+    asyncio.run(scenario())
+
+    assert len(budgets) == 1
+    session_id, budget, remaining = budgets[0]
+    assert session_id == "session-1"
+    assert budget == FINALIZE_BUDGET_SECONDS
+    assert remaining > FINALIZE_BUDGET_SECONDS - 1
+    assert "session-1" not in main.idle_renders
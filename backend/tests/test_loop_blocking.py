@@ -0,0 +1,57 @@
+import asyncio
+import itertools
+
+import cv2
+import httpx
+
+import main
+from benchmarks.bench_matting import synthetic_ring
+from utils import http_pool
+from utils.loop_monitor import detect_blocking
+
+
+def _mock_upstream():
+    """Seedream returns links to a CDN that serves a 1024px ring render"""
+    image, _ = synthetic_ring(size=1024)
+    png = cv2.imencode(".png", image)[1].tobytes()
+    counter = itertools.count()
+
+    async def handler(request):
+        if request.method == "POST":
+            body = request.read().decode()
+            count = 4 if "sequential_image_generation" in body else 1
+            return httpx.Response(200, json={
+                "data": [{"url": f"https://cdn.test/{next(counter)}.png"} for _ in range(count)]
+            })
+        return httpx.Response(200, content=png, headers={"content-type": "image/png"})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_generate_and_modify_do_not_block_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.image_generator, "has_api_key", True)
+    monkeypatch.setattr(main.image_generator.seedream, "api_key", "test")
+    monkeypatch.setattr(main.image_generator.seedream, "enabled", True)
+    monkeypatch.setattr(main.media_mirror, "directory", str(tmp_path))
+    monkeypatch.setattr(main, "IDLE_RENDER_SECONDS", 0)
+
+    async def scenario():
+        http_pool._client = _mock_upstream()
+        app = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(transport=app, base_url="http://app") as client:
+                # Process pools start outside the measured block
+                await asyncio.to_thread(main.local_enhancer.warm_up)
+                async with detect_blocking():
+                    generated = await client.post("/generate", json={"prompt": "gold ring with a ruby"})
+                    assert generated.status_code == 200
+                    modified = await client.post("/modify", json={"session_id": generated.json()["session_id"]})
+                    assert modified.status_code == 200
+        finally:
+            await http_pool.close_http_client()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        main.local_enhancer.shutdown()
+        main.shutdown_pools()
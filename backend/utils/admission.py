@@ -0,0 +1,155 @@
+import asyncio
+import functools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+# Requests each endpoint works on at once; more wait in a bounded queue
+ADMISSION_LIMITS = {
+    "generate": int(os.getenv("ADMISSION_GENERATE_CONCURRENCY", "4")),
+    "modify": int(os.getenv("ADMISSION_MODIFY_CONCURRENCY", "4")),
+    "finalize": int(os.getenv("ADMISSION_FINALIZE_CONCURRENCY", "2")),
+}
+# Requests allowed to wait per endpoint; beyond this they get an immediate 503
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "8"))
+# Longest a queued request waits for a slot before it is turned away (seconds)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+# Service time assumed for wait estimates until real requests have completed
+ADMISSION_DEFAULT_SERVICE_SECONDS = float(os.getenv("ADMISSION_DEFAULT_SERVICE_SECONDS", "30"))
+
+
+class AdmissionRejected(Exception):
+    """The endpoint is at capacity; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"{endpoint} is at capacity, retry in {retry_after}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Concurrency limit plus a bounded FIFO wait queue for one endpoint.
+
+    Tracks a moving average of how long admitted requests take, which turns
+    queue depth into an estimated wait for Retry-After and /capacity.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int = ADMISSION_QUEUE_SIZE):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_service = ADMISSION_DEFAULT_SERVICE_SECONDS
+        self.completed = 0
+
+    def estimated_wait(self) -> float:
+        """Seconds a request arriving now would wait for a slot"""
+        if self.in_flight + self.waiting < self.limit:
+            return 0.0
+        # Waiters ahead of us are admitted `limit` at a time, one service time per round
+        rounds = (self.waiting + self.in_flight - self.limit) // self.limit + 1
+        return rounds * self.avg_service
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.estimated_wait()))
+
+    def _record(self, seconds: float):
+        self.completed += 1
+        # Moving average; the first samples replace the default quickly
+        weight = max(0.1, 1 / self.completed)
+        self.avg_service += weight * (seconds - self.avg_service)
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.in_flight + self.waiting >= self.limit + self.queue_size:
+            self.rejected += 1
+            raise AdmissionRejected(self.name, self.retry_after())
+
+        self.waiting += 1
+        try:
+            if self.semaphore.locked():
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=ADMISSION_QUEUE_TIMEOUT)
+            else:
+                await self.semaphore.acquire()  # Free slot: returns without suspending
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AdmissionRejected(self.name, self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+            self._record(time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "queue_limit": self.queue_size,
+            "estimated_wait_seconds": round(self.estimated_wait(), 1),
+            "avg_service_seconds": round(self.avg_service, 2),
+            "admitted_total": self.admitted,
+            "rejected_total": self.rejected,
+        }
+
+
+_gates: Dict[str, AdmissionGate] = {}
+
+
+def gate_for(endpoint: str) -> AdmissionGate:
+    if endpoint not in _gates:
+        _gates[endpoint] = AdmissionGate(endpoint, ADMISSION_LIMITS.get(endpoint, 4))
+    return _gates[endpoint]
+
+
+def admission(endpoint: str):
+    """Decorator admitting an async endpoint through its gate (raises AdmissionRejected when full)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with gate_for(endpoint).admit():
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def capacity_snapshot() -> dict:
+    endpoints = {name: gate_for(name).snapshot() for name in ADMISSION_LIMITS}
+    return {
+        "in_flight": sum(e["in_flight"] for e in endpoints.values()),
+        "queued": sum(e["queued"] for e in endpoints.values()),
+        "saturated": any(e["in_flight"] >= e["limit"] for e in endpoints.values()),
+        "endpoints": endpoints,
+    }
+
+
+def capacity_prometheus() -> str:
+    """Admission metrics in Prometheus text exposition format"""
+    lines = []
+    metrics = (
+        ("admission_in_flight", "gauge", "Requests being worked on", "in_flight"),
+        ("admission_queued", "gauge", "Requests waiting for a slot", "queued"),
+        ("admission_estimated_wait_seconds", "gauge", "Estimated wait for a new request", "estimated_wait_seconds"),
+        ("admission_rejected_total", "counter", "Requests turned away with 503", "rejected_total"),
+    )
+    snapshots = {name: gate_for(name).snapshot() for name in ADMISSION_LIMITS}
+    for metric, kind, help_text, key in metrics:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        for name, snapshot in snapshots.items():
+            lines.append(f'{metric}{{endpoint="{name}"}} {snapshot[key]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+from .seedream_client import track_usage, usage_cost
+
+
+BULK_CHECKPOINT_DIR = os.getenv("BULK_CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "bulk_jobs"))
+# Items generated at the same time across all bulk jobs
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+# Items started per minute across all bulk jobs (0 disables the limit)
+BULK_RATE_PER_MINUTE = float(os.getenv("BULK_RATE_PER_MINUTE", "30"))
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "2"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+
+
+class RateLimiter:
+    """Spaces out starts so no more than `per_minute` happen in any minute"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.interval <= 0:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class BulkJob:
+    def __init__(self, job_id: str, prompts: List[str], created_at: float):
+        self.job_id = job_id
+        self.prompts = prompts
+        self.created_at = created_at
+        self.results = {}  # item index -> result record
+        self.order = []  # item indexes in completion order, for streaming
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.changed = asyncio.Condition()
+        self.checkpoint_lock = asyncio.Lock()  # One results.jsonl append at a time
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) == len(self.prompts)
+
+    def summary(self) -> dict:
+        completed = [r for r in self.results.values() if r["status"] == "done"]
+        failed = [r for r in self.results.values() if r["status"] == "failed"]
+        total_cost = sum(r.get("cost", 0.0) for r in self.results.values())
+        summary = {
+            "job_id": self.job_id,
+            "total": len(self.prompts),
+            "completed": len(completed),
+            "failed": len(failed),
+            "pending": len(self.prompts) - len(self.results),
+            "status": "finished" if self.done else "running",
+            "total_cost": round(total_cost, 4),
+            "cost_per_item": round(total_cost / len(self.results), 4) if self.results else None,
+            "avg_item_seconds": (
+                round(sum(r["seconds"] for r in self.results.values()) / len(self.results), 2)
+                if self.results else None
+            ),
+        }
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            summary["runtime_seconds"] = round(end - self.started_at, 2)
+        return summary
+
+
+class BulkJobManager:
+    """
+    Runs many design generations under global concurrency and rate limits.
+
+    Every finished item is appended to a per-job results.jsonl checkpoint, so a
+    restarted worker resumes each job with only the items that had not finished.
+    Checkpoint files are written and read in worker threads (fsync can take
+    tens of milliseconds), never on the event loop.
+    """
+
+    def __init__(self, run_item: Callable[[str], Awaitable[dict]], checkpoint_dir: str = BULK_CHECKPOINT_DIR):
+        self.run_item = run_item
+        self.checkpoint_dir = checkpoint_dir
+        self.jobs = {}
+        self.tasks = {}
+        self._semaphore = None
+        self._rate_limiter = None
+
+    def _limits(self):
+        # Created lazily so they bind to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+            self._rate_limiter = RateLimiter(BULK_RATE_PER_MINUTE)
+        return self._semaphore, self._rate_limiter
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.checkpoint_dir, job_id)
+
+    def _write_manifest(self, job: BulkJob):
+        os.makedirs(self._job_dir(job.job_id), exist_ok=True)
+        with open(os.path.join(self._job_dir(job.job_id), "manifest.json"), "w") as f:
+            json.dump({"job_id": job.job_id, "prompts": job.prompts, "created_at": job.created_at}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def create_job(self, prompts: List[str]) -> BulkJob:
+        job = BulkJob(uuid.uuid4().hex, prompts, time.time())
+        await asyncio.to_thread(self._write_manifest, job)
+        self.jobs[job.job_id] = job
+        self._start(job)
+        return job
+
+    def _load_checkpoints(self) -> List[tuple]:
+        """Read every checkpointed job from disk: (job_id, manifest, records, finished_at). Blocking."""
+        loaded = []
+        if not os.path.isdir(self.checkpoint_dir):
+            return loaded
+        for job_id in os.listdir(self.checkpoint_dir):
+            manifest_path = os.path.join(self._job_dir(job_id), "manifest.json")
+            if job_id in self.jobs or not os.path.exists(manifest_path):
+                continue
+            try:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                records = []
+                finished_at = None
+                results_path = os.path.join(self._job_dir(job_id), "results.jsonl")
+                if os.path.exists(results_path):
+                    with open(results_path) as f:
+                        for line in f:
+                            line = line.strip()
+                            if not line:
+                                continue
+                            try:
+                                records.append(json.loads(line))
+                            except json.JSONDecodeError:
+                                continue  # torn write from a crash mid-append
+                    # Rewrite without any torn trailing line so new appends stay valid
+                    with open(results_path, "w") as f:
+                        for record in records:
+                            f.write(json.dumps(record) + "\n")
+                    finished_at = os.path.getmtime(results_path)
+            except Exception as e:
+                print(f"Could not reload bulk job {job_id}: {e}")
+                continue
+            loaded.append((job_id, manifest, records, finished_at))
+        return loaded
+
+    async def resume(self):
+        """Reload checkpointed jobs and restart any that have unfinished items"""
+        for job_id, manifest, records, finished_at in await asyncio.to_thread(self._load_checkpoints):
+            job = BulkJob(job_id, manifest["prompts"], manifest["created_at"])
+            for record in records:
+                job.results[record["index"]] = record
+                job.order.append(record["index"])
+            self.jobs[job_id] = job
+            if job.done:
+                job.finished_at = finished_at
+            else:
+                print(f"Resuming bulk job {job_id}: {len(job.prompts) - len(job.results)} items left")
+                self._start(job)
+
+    def _start(self, job: BulkJob):
+        self.tasks[job.job_id] = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: BulkJob):
+        job.started_at = time.time()
+        remaining = [i for i in range(len(job.prompts)) if i not in job.results]
+        await asyncio.gather(*(self._run_one(job, index) for index in remaining))
+        job.finished_at = time.time()
+        summary = job.summary()
+        print(f"Bulk job {job.job_id} finished: {summary['completed']} ok, {summary['failed']} failed "
+              f"in {summary.get('runtime_seconds')}s")
+        async with job.changed:
+            job.changed.notify_all()
+
+    async def _run_one(self, job: BulkJob, index: int):
+        semaphore, rate_limiter = self._limits()
+        prompt = job.prompts[index]
+        record = None
+        async with semaphore:
+            # Usage covers every attempt, so retries show up in the item's cost
+            with track_usage() as usage:
+                started = time.perf_counter()
+                for attempt in range(BULK_MAX_RETRIES + 1):
+                    await rate_limiter.acquire()
+                    try:
+                        result = await self.run_item(prompt)
+                        record = {"index": index, "prompt": prompt, "status": "done", "attempts": attempt + 1}
+                        record.update(result)
+                        break
+                    except Exception as e:
+                        print(f"Bulk item {index} attempt {attempt + 1} failed: {e}")
+                        record = {
+                            "index": index, "prompt": prompt, "status": "failed",
+                            "attempts": attempt + 1, "error": str(e),
+                        }
+                        if attempt < BULK_MAX_RETRIES:
+                            await asyncio.sleep(2 ** attempt)
+                record["seconds"] = round(time.perf_counter() - started, 2)
+                record["upstream_calls"] = usage["calls"]
+                record["cost"] = usage_cost(usage)
+
+        async with job.checkpoint_lock:
+            await asyncio.to_thread(self._checkpoint, job, record)
+        async with job.changed:
+            job.results[index] = record
+            job.order.append(index)
+            job.changed.notify_all()
+
+    def _checkpoint(self, job: BulkJob, record: dict):
+        """Append one finished item durably. Blocking - run in a thread."""
+        with open(os.path.join(self._job_dir(job.job_id), "results.jsonl"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def stream(self, job: BulkJob):
+        """Yield NDJSON lines: finished items as they complete, then the job summary"""
+        sent = 0
+        while True:
+            async with job.changed:
+                while sent == len(job.order) and not (job.done and job.finished_at is not None):
+                    await job.changed.wait()
+                pending = [job.results[i] for i in job.order[sent:]]
+                sent = len(job.order)
+                finished = job.done and job.finished_at is not None
+            for record in pending:
+                yield json.dumps(record) + "\n"
+            if finished and sent == len(job.order):
+                yield json.dumps({"summary": job.summary()}) + "\n"
+                return
@@ -0,0 +1,172 @@
+import os
+import time
+from collections import deque
+from typing import Optional
+
+
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Calls slower than this count towards the slow-call rate even when they succeed
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "60"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+# A probe slot not settled within this long is presumed abandoned and handed out
+# again, so a leaked probe cannot keep the breaker half-open forever
+BREAKER_PROBE_LEASE_SECONDS = float(os.getenv("BREAKER_PROBE_LEASE_SECONDS", "300"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker for one upstream endpoint.
+
+    The breaker opens when, over the last BREAKER_WINDOW_SECONDS, enough calls
+    were made and either the error rate or the slow-call rate crosses its
+    threshold. After BREAKER_OPEN_SECONDS it lets a few probe calls through
+    (half-open); a successful probe closes it again, a failed one re-opens it.
+    Probe slots are leased for BREAKER_PROBE_LEASE_SECONDS.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.outcomes = deque()  # (timestamp, ok, latency)
+        self.probe_leases = deque()  # Start times of the probes in flight
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _trim(self, now: float):
+        while self.outcomes and now - self.outcomes[0][0] > BREAKER_WINDOW_SECONDS:
+            self.outcomes.popleft()
+
+    def _rates(self):
+        total = len(self.outcomes)
+        if total == 0:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self.outcomes if not ok)
+        slow = sum(1 for _, _, latency in self.outcomes if latency >= BREAKER_SLOW_CALL_SECONDS)
+        return total, errors / total, slow / total
+
+    def _open(self, now: float):
+        if self.state != OPEN:
+            self.times_opened += 1
+            print(f"Circuit breaker '{self.name}' OPEN")
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_leases.clear()
+
+    @property
+    def probes_in_flight(self) -> int:
+        return len(self.probe_leases)
+
+    def _advance(self, now: float):
+        """Move to half-open once the open period is over; expire stale probe leases"""
+        if self.state == OPEN and now - self.opened_at >= BREAKER_OPEN_SECONDS:
+            print(f"Circuit breaker '{self.name}' half-open, probing upstream")
+            self.state = HALF_OPEN
+            self.probe_leases.clear()
+        while self.probe_leases and now - self.probe_leases[0] >= BREAKER_PROBE_LEASE_SECONDS:
+            print(f"Circuit breaker '{self.name}': probe never settled, releasing its slot")
+            self.probe_leases.popleft()
+
+    def would_reject(self) -> bool:
+        """True if allow_request() would refuse a call now; reserves nothing"""
+        self._advance(time.monotonic())
+        return self.state == OPEN or (
+            self.state == HALF_OPEN and self.probes_in_flight >= BREAKER_HALF_OPEN_PROBES
+        )
+
+    def allow_request(self) -> bool:
+        """True if a call may go upstream now; reserves a probe slot when half-open"""
+        now = time.monotonic()
+        self._advance(now)
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes_in_flight < BREAKER_HALF_OPEN_PROBES:
+            self.probe_leases.append(now)
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self, latency: float):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            if latency >= BREAKER_SLOW_CALL_SECONDS:
+                self._open(now)
+                return
+            print(f"Circuit breaker '{self.name}' closed after successful probe")
+            self.state = CLOSED
+            self.outcomes.clear()
+            self.probe_leases.clear()
+        self.outcomes.append((now, True, latency))
+        self._evaluate(now)
+
+    def record_failure(self, latency: float):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+        self.outcomes.append((now, False, latency))
+        self._evaluate(now)
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call was abandoned (e.g. cancelled)"""
+        if self.state == HALF_OPEN and self.probe_leases:
+            self.probe_leases.pop()
+
+    def _evaluate(self, now: float):
+        if self.state != CLOSED:
+            return
+        self._trim(now)
+        total, error_rate, slow_rate = self._rates()
+        if total < BREAKER_MIN_CALLS:
+            return
+        if error_rate >= BREAKER_ERROR_RATE or slow_rate >= BREAKER_SLOW_CALL_RATE:
+            print(f"Circuit breaker '{self.name}': error rate {error_rate:.0%}, slow rate {slow_rate:.0%}")
+            self._open(now)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        self._trim(now)
+        total, error_rate, slow_rate = self._rates()
+        latencies = sorted(latency for _, _, latency in self.outcomes)
+        snapshot = {
+            "state": self.state,
+            "calls_in_window": total,
+            "error_rate": round(error_rate, 3),
+            "slow_call_rate": round(slow_rate, 3),
+            "p50_latency": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+        if self.state == OPEN:
+            snapshot["retry_in"] = round(max(0.0, BREAKER_OPEN_SECONDS - (now - self.opened_at)), 1)
+        return snapshot
+
+
+_breakers = {}
+
+
+def breaker_for(upstream: str, endpoint: str) -> CircuitBreaker:
+    """Return the breaker guarding one endpoint of one upstream service"""
+    name = f"{upstream}:{endpoint}"
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
+
+
+def breaker_snapshot() -> dict:
+    """State of every breaker, keyed by 'upstream:endpoint'"""
+    return {name: breaker.snapshot() for name, breaker in sorted(_breakers.items())}
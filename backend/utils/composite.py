@@ -0,0 +1,142 @@
+import io
+import os
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .payload import MAX_ASPECT, MIN_ASPECT, output_max_side
+
+
+# White gutter (pixels) between tiles and around the canvas, so an enhancement
+# that bleeds across a tile edge lands in the gutter instead of the next crop
+COMPOSITE_SEAM = int(os.getenv("COMPOSITE_SEAM", "32"))
+# Largest relative difference between the enhanced canvas' aspect ratio and the
+# one we sent before the tiles are considered misplaced
+COMPOSITE_ASPECT_TOLERANCE = float(os.getenv("COMPOSITE_ASPECT_TOLERANCE", "0.01"))
+
+
+def _shelf_pack(sizes: List[Tuple[int, int]], order: List[int], max_width: int, seam: int):
+    """Place tiles left to right in rows no wider than max_width; returns (width, height, positions)"""
+    positions = {}
+    x = y = seam
+    row_height = 0
+    width = 0
+    for index in order:
+        w, h = sizes[index]
+        if x > seam and x + w + seam > max_width:
+            x = seam
+            y += row_height + seam
+            row_height = 0
+        positions[index] = (x, y)
+        x += w + seam
+        row_height = max(row_height, h)
+        width = max(width, x)
+    return width, y + row_height + seam, positions
+
+
+def pack_tiles(sizes: List[Tuple[int, int]], seam: int = COMPOSITE_SEAM):
+    """
+    Aspect-aware shelf packing of tiles into one canvas.
+
+    Tries every row width between the widest tile and a single row, and keeps
+    the layout with the smallest canvas once it is padded to an aspect ratio
+    Seedream accepts (MIN_ASPECT..MAX_ASPECT). Returns (width, height, boxes)
+    with boxes[i] = (x, y, w, h) for sizes[i].
+    """
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True)
+    widest = max(w for w, _ in sizes)
+    candidates = {widest + 2 * seam}
+    running = seam
+    for index in order:
+        running += sizes[index][0] + seam
+        candidates.add(running)
+
+    best = None
+    for max_width in sorted(candidates):
+        width, height, positions = _shelf_pack(sizes, order, max_width, seam)
+        # Pad the short side until the canvas is within the accepted aspect range
+        padded_w = max(width, int(height * MIN_ASPECT) + 1)
+        padded_h = max(height, int(padded_w / MAX_ASPECT) + 1)
+        score = (padded_w * padded_h, abs(padded_w / padded_h - 1.0))
+        if best is None or score < best[0]:
+            best = (score, padded_w, padded_h, width, height, positions)
+
+    _, canvas_w, canvas_h, width, height, positions = best
+    # Centre the packed block on the (possibly padded) canvas
+    off_x, off_y = (canvas_w - width) // 2, (canvas_h - height) // 2
+    boxes = [(positions[i][0] + off_x, positions[i][1] + off_y, w, h) for i, (w, h) in enumerate(sizes)]
+    return canvas_w, canvas_h, boxes
+
+
+def compose_crops(crops: Dict[str, bytes], seam: int = COMPOSITE_SEAM) -> Tuple[bytes, dict]:
+    """
+    Pack crops into one white canvas. Returns (PNG bytes, layout); the layout
+    records the canvas size and each crop's box so split_composite can cut the
+    enhanced canvas back apart. Blocking - run in a thread.
+    """
+    names = list(crops)
+    images = []
+    for name in names:
+        img = Image.open(io.BytesIO(crops[name]))
+        img.load()
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            flattened = Image.new("RGB", img.size, "white")
+            flattened.paste(img, mask=img.split()[-1])
+            img = flattened
+        images.append(img.convert("RGB"))
+
+    canvas_w, canvas_h, boxes = pack_tiles([img.size for img in images], seam)
+    canvas = Image.new("RGB", (canvas_w, canvas_h), "white")
+    for img, (x, y, _, _) in zip(images, boxes):
+        canvas.paste(img, (x, y))
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="PNG")
+    layout = {"canvas": [canvas_w, canvas_h], "tiles": {name: list(box) for name, box in zip(names, boxes)}}
+    return buffer.getvalue(), layout
+
+
+def output_size(layout: dict, size: str) -> str:
+    """
+    Explicit "WxH" for Seedream: the canvas scaled so its long side matches
+    the `size` preset, keeping the canvas' aspect ratio (a bare preset lets
+    the model pick its own shape). Sides are rounded to multiples of 8.
+    """
+    canvas_w, canvas_h = layout["canvas"]
+    factor = output_max_side(size) / max(canvas_w, canvas_h)
+    width, height = (max(8, int(round(side * factor / 8)) * 8) for side in (canvas_w, canvas_h))
+    return f"{width}x{height}"
+
+
+def split_composite(image_bytes: bytes, layout: dict) -> Optional[Dict[str, bytes]]:
+    """
+    Cut an enhanced canvas back into its crops (PNG bytes per region name).
+
+    The output may be at a different resolution than the canvas we sent, so
+    boxes are scaled by the size ratio. Returns None when the output's aspect
+    ratio differs from the canvas' (the model re-framed it, so the boxes no
+    longer line up). Blocking - run in a thread.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    canvas_w, canvas_h = layout["canvas"]
+    drift = abs((img.width / img.height) / (canvas_w / canvas_h) - 1.0)
+    if drift > COMPOSITE_ASPECT_TOLERANCE:
+        print(f"Composite came back {img.width}x{img.height} for a {canvas_w}x{canvas_h} canvas "
+              f"(aspect off by {drift:.1%}); not splitting")
+        return None
+    scale_x, scale_y = img.width / canvas_w, img.height / canvas_h
+
+    tiles = {}
+    for name, (x, y, w, h) in layout["tiles"].items():
+        box = (
+            int(round(x * scale_x)),
+            int(round(y * scale_y)),
+            int(round((x + w) * scale_x)),
+            int(round((y + h) * scale_y)),
+        )
+        buffer = io.BytesIO()
+        img.crop(box).save(buffer, format="PNG")
+        tiles[name] = buffer.getvalue()
+    return tiles
@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Per-endpoint latency budgets (seconds). Every stage of a request draws from
+# the same budget, so a slow upstream call can never hold a request past it.
+GENERATE_BUDGET_SECONDS = float(os.getenv("GENERATE_BUDGET_SECONDS", "90"))
+MODIFY_BUDGET_SECONDS = float(os.getenv("MODIFY_BUDGET_SECONDS", "90"))
+FINALIZE_BUDGET_SECONDS = float(os.getenv("FINALIZE_BUDGET_SECONDS", "120"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has used up its latency budget"""
+
+
+class Deadline:
+    """A fixed point in time by which a request must have produced its response"""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, default: float) -> float:
+        """Clamp a stage timeout so it never outlives the request"""
+        return min(default, self.remaining())
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request being served, if any"""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(budget: float):
+    """Run the enclosed block (and every task it spawns) under a latency budget"""
+    parent = _current_deadline.get()
+    deadline = Deadline(budget)
+    # A nested scope may tighten but never extend the enclosing budget
+    if parent is not None and parent.expires_at < deadline.expires_at:
+        deadline = parent
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def detached_context() -> contextvars.Context:
+    """Copy of the current context without the request deadline, for tasks that outlive the request"""
+    context = contextvars.copy_context()
+    context.run(_current_deadline.set, None)
+    return context
+
+
+def remaining_timeout(default: float) -> float:
+    """Timeout for a single stage: the stage default clamped to the request budget"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    return deadline.timeout(default)
+
+
+def budget_left(minimum: float = 0.0) -> bool:
+    """True when the current request still has more than `minimum` seconds left"""
+    deadline = _current_deadline.get()
+    return deadline is None or deadline.remaining() > minimum
+
+
+async def within_deadline(awaitable, fallback=None):
+    """Await `awaitable` but give up with `fallback` once the request budget runs out"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    if deadline.expired:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        return fallback
+    try:
+        return await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        print(f"Deadline reached after {deadline.elapsed():.1f}s, degrading to fallback")
+        return fallback
+
+
+def with_deadline(budget: float):
+    """Decorator running an async endpoint under its own latency budget"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with deadline_scope(budget):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
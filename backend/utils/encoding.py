@@ -0,0 +1,204 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder (several times slower on image payloads)
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Bodies smaller than this are sent uncompressed (not worth the CPU)
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+# Bodies where base64 images make up more than this fraction are sent uncompressed:
+# gzip takes >1s on a typical /finalize body to save ~25%, which multipart gets
+# for free. Set to 1 to compress them anyway.
+RESPONSE_COMPRESS_MAX_IMAGE_FRACTION = float(os.getenv("RESPONSE_COMPRESS_MAX_IMAGE_FRACTION", "0.5"))
+# Base64 of already-compressed PNGs only shrinks ~25% and higher levels barely
+# improve on that, so the fastest level is used (multipart is cheaper still)
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "1"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+# Responses at least this large are encoded in a worker thread instead of on the event loop
+RESPONSE_THREAD_MIN_BYTES = int(os.getenv("RESPONSE_THREAD_MIN_BYTES", str(256 * 1024)))
+
+MULTIPART_MEDIA_TYPE = "multipart/mixed"
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize plain dict/list/str content to UTF-8 JSON without FastAPI's jsonable_encoder pass"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepts(header: str, token: str) -> bool:
+    """Whether a comma-separated Accept / Accept-Encoding header lists `token` with a non-zero q"""
+    for item in header.lower().split(","):
+        name, *params = item.split(";")
+        if name.strip() != token:
+            continue
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Content-Encoding to use for a client: br when available and accepted, else gzip, else none"""
+    if brotli is not None and _accepts(accept_encoding, "br"):
+        return "br"
+    if _accepts(accept_encoding, "gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    return body
+
+
+def encode_json(content: Any, encoding: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    """
+    JSON body for `content`, compressed with `encoding` when large enough.
+
+    Returns (body, content encoding actually applied). Blocking for large
+    payloads - see RESPONSE_THREAD_MIN_BYTES.
+    """
+    body = dumps(content)
+    if encoding is None or len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    return compress(body, encoding), encoding
+
+
+def _split_data_url(value: str) -> Optional[Tuple[str, bytes]]:
+    """(mime type, raw bytes) for a base64 data URL, None for anything else"""
+    if not value.startswith("data:"):
+        return None
+    header, sep, data = value.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return None
+    return header[5:-7] or "application/octet-stream", base64.b64decode(data)
+
+
+def extract_images(content: Any, parts: List[Tuple[str, str, bytes]]) -> Any:
+    """
+    Copy of `content` with every base64 data URL replaced by "cid:<id>".
+
+    The decoded images are appended to `parts` as (content id, mime, bytes),
+    so they travel as raw bytes instead of base64 (25% smaller, no decode on
+    the client).
+    """
+    if isinstance(content, dict):
+        return {key: extract_images(value, parts) for key, value in content.items()}
+    if isinstance(content, list):
+        return [extract_images(value, parts) for value in content]
+    if isinstance(content, str):
+        image = _split_data_url(content)
+        if image is not None:
+            content_id = f"image-{len(parts)}"
+            parts.append((content_id, image[0], image[1]))
+            return f"cid:{content_id}"
+    return content
+
+
+def encode_multipart(content: Any) -> Tuple[List[bytes], str]:
+    """
+    multipart/mixed body: a JSON metadata part, then one binary part per image.
+
+    The metadata refers to images as "cid:<id>", matching each part's
+    Content-ID. Returns (chunks, boundary); chunks are streamed as they are,
+    never joined into one buffer. Blocking - run in a thread for large payloads.
+    """
+    parts: List[Tuple[str, str, bytes]] = []
+    metadata = dumps(extract_images(content, parts))
+    boundary = uuid.uuid4().hex
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+
+    chunks = [
+        delimiter,
+        f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(metadata)}\r\n\r\n".encode("ascii"),
+        metadata,
+    ]
+    for content_id, mime, data in parts:
+        chunks += [
+            b"\r\n" + delimiter,
+            f"Content-Type: {mime}\r\nContent-ID: <{content_id}>\r\nContent-Length: {len(data)}\r\n\r\n".encode("ascii"),
+            data,
+        ]
+    chunks.append(f"\r\n--{boundary}--\r\n".encode("ascii"))
+    return chunks, boundary
+
+
+def _estimated_size(content: Any) -> Tuple[int, int]:
+    """Rough serialized size and how much of it is data URLs (which dominate image payloads)"""
+    if isinstance(content, (dict, list)):
+        sizes = [_estimated_size(value) for value in (content.values() if isinstance(content, dict) else content)]
+        return sum(total for total, _ in sizes), sum(images for _, images in sizes)
+    if isinstance(content, str):
+        return len(content), len(content) if content.startswith("data:") else 0
+    return 8, 0
+
+
+def json_encoding_for(content: Any, accept_encoding: str) -> Optional[str]:
+    """Content-Encoding for a JSON body: none when it is mostly (incompressible) base64 images"""
+    total, images = _estimated_size(content)
+    if images > RESPONSE_COMPRESS_MAX_IMAGE_FRACTION * total:
+        return None
+    return choose_encoding(accept_encoding)
+
+
+async def negotiated_response(request: Request, content: Dict[str, Any], status_code: int = 200) -> Response:
+    """
+    Encode an image-heavy endpoint result for the client that asked for it.
+
+    `Accept: multipart/mixed` gets raw image parts next to JSON metadata;
+    everyone else gets JSON, brotli- or gzip-compressed per Accept-Encoding
+    unless the body is mostly base64 images.
+    Large payloads are encoded in a worker thread so the event loop keeps
+    serving other requests. Returned as a Response, so FastAPI skips its own
+    jsonable_encoder pass over the content.
+    """
+    offload = _estimated_size(content)[0] >= RESPONSE_THREAD_MIN_BYTES
+
+    async def run(func, *args):
+        return await asyncio.to_thread(func, *args) if offload else func(*args)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if _accepts(request.headers.get("accept", ""), MULTIPART_MEDIA_TYPE):
+        chunks, boundary = await run(encode_multipart, content)
+        headers["Content-Length"] = str(sum(len(chunk) for chunk in chunks))
+
+        async def stream() -> AsyncIterator[bytes]:
+            for chunk in chunks:
+                yield chunk
+
+        return StreamingResponse(
+            stream(), status_code=status_code, headers=headers,
+            media_type=f'{MULTIPART_MEDIA_TYPE}; boundary="{boundary}"'
+        )
+
+    encoding = json_encoding_for(content, request.headers.get("accept-encoding", ""))
+    body, applied = await run(encode_json, content, encoding)
+    if applied:
+        headers["Content-Encoding"] = applied
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from .deadline import DeadlineExceeded, current_deadline
+
+
+# Send a duplicate request once the first has been outstanding for longer than
+# this percentile of recently observed latencies.
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+# Delay used until enough samples have been observed to estimate the percentile
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one upstream endpoint"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def hedge_delay(self, pct: float = HEDGE_PERCENTILE) -> float:
+        observed = self.percentile(pct)
+        if observed is None:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, observed)
+
+
+async def hedged(
+    call: Callable[[], Awaitable],
+    tracker: LatencyTracker,
+    label: str = "upstream",
+    max_attempts: int = 2,
+):
+    """
+    Run an idempotent upstream call, hedging it with duplicates.
+
+    A duplicate is started whenever the outstanding attempts have run longer
+    than the tracker's hedge delay. The first attempt to return a non-None
+    result wins and the others are cancelled. If every attempt fails the last
+    exception is re-raised (or None is returned). The whole call is bounded by
+    the current request deadline and raises DeadlineExceeded when it runs out.
+    """
+    if not HEDGE_ENABLED:
+        max_attempts = 1
+
+    deadline = current_deadline()
+    pending = set()
+    started = {}
+    last_error = None
+    attempts = 0
+
+    def launch():
+        nonlocal attempts
+        attempts += 1
+        task = asyncio.ensure_future(call())
+        started[task] = time.monotonic()
+        pending.add(task)
+
+    try:
+        launch()
+        while pending:
+            wait_for = None
+            if attempts < max_attempts:
+                wait_for = tracker.hedge_delay()
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"{label}: request budget exhausted")
+                wait_for = remaining if wait_for is None else min(wait_for, remaining)
+
+            done, _ = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                if attempts < max_attempts and (deadline is None or not deadline.expired):
+                    print(f"Hedging {label}: attempt {attempts} slow, sending duplicate")
+                    launch()
+                    continue
+                raise DeadlineExceeded(f"{label}: request budget exhausted")
+
+            for task in done:
+                pending.discard(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if result is not None:
+                    tracker.record(time.monotonic() - started[task])
+                    return result
+            # Finished attempts failed; keep waiting on any still outstanding
+
+        if last_error is not None:
+            raise last_error
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
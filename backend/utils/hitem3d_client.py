@@ -3,6 +3,7 @@ import httpx
 import asyncio
 import time
 from typing import Optional
+from .circuit_breaker import breaker_for
 
 
 class Hitem3DClient:
@@ -29,15 +30,30 @@ class Hitem3DClient:
             print("⚠️ Hitem3D disabled - no API credentials")
             return None
         
+        submit_breaker = breaker_for("hitem3d", "submit")
+        if not submit_breaker.allow_request():
+            print("⚠️ Hitem3D circuit open - skipping 3D generation")
+            return None
+        
         try:
             print(f"🎨 Starting Hitem3D 3D model generation...")
             
             # Submit generation task
-            task_id = await self._submit_task(image_url, resolution, texture_enabled)
+            started = time.time()
+            try:
+                task_id = await self._submit_task(image_url, resolution, texture_enabled)
+            except asyncio.CancelledError:
+                submit_breaker.release_probe()  # Abandoned, not failed
+                raise
+            except Exception:
+                submit_breaker.record_failure(time.time() - started)
+                raise
             
             if not task_id:
+                submit_breaker.record_failure(time.time() - started)
                 print("❌ Failed to submit 3D generation task")
                 return None
+            submit_breaker.record_success(time.time() - started)
             
             print(f"✅ Task submitted: {task_id}")
             
@@ -242,41 +258,60 @@ class Hitem3DClient:
             "Content-Type": "application/json"
         }
         
+        status_breaker = breaker_for("hitem3d", "status")
+        
         async with httpx.AsyncClient(timeout=60.0) as client:
             while time.time() - start_time < max_wait_time:
-                for url in status_urls:
-                    try:
-                        response = await client.get(url, headers=headers)
+                if not status_breaker.allow_request():
+                    print(f"⚠️ Hitem3D status circuit open - giving up on task {task_id}")
+                    return None
+                
+                answered = False
+                poll_started = time.time()
+                polled = False
+                # Every exit records the outcome so a half-open probe slot is never leaked
+                try:
+                    for url in status_urls:
+                        try:
+                            response = await client.get(url, headers=headers)
                         
-                        if response.status_code == 200:
-                            data = response.json()
-                            status = data.get("status", "").lower()
+                            if response.status_code == 200:
+                                answered = True
+                                data = response.json()
+                                status = data.get("status", "").lower()
                             
-                            print(f"⏳ Task {task_id}: {status}")
+                                print(f"⏳ Task {task_id}: {status}")
                             
-                            if status in ["completed", "done", "finished", "success"]:
-                                model_url = (
-                                    data.get("model_url") or
-                                    data.get("glb_url") or
-                                    data.get("download_url") or
-                                    data.get("url") or
-                                    (data.get("result") or {}).get("glb")
-                                )
+                                if status in ["completed", "done", "finished", "success"]:
+                                    model_url = (
+                                        data.get("model_url") or
+                                        data.get("glb_url") or
+                                        data.get("download_url") or
+                                        data.get("url") or
+                                        (data.get("result") or {}).get("glb")
+                                    )
                                 
-                                if model_url:
-                                    return str(model_url)
+                                    if model_url:
+                                        return str(model_url)
                             
-                            elif status in ["failed", "error"]:
-                                error = data.get("error") or "Unknown error"
-                                print(f"❌ Generation failed: {error}")
-                                return None
+                                elif status in ["failed", "error"]:
+                                    error = data.get("error") or "Unknown error"
+                                    print(f"❌ Generation failed: {error}")
+                                    return None
                             
-                            # Still processing
-                            break
+                                # Still processing
+                                break
                             
-                    except Exception:
-                        continue
-                
+                        except Exception:
+                            continue
+                    polled = True
+                finally:
+                    if answered:
+                        status_breaker.record_success(time.time() - poll_started)
+                    elif polled:
+                        status_breaker.record_failure(time.time() - poll_started)
+                    else:
+                        status_breaker.release_probe()
                 await asyncio.sleep(poll_interval)
         
         print(f"⏱️ Timeout after {max_wait_time}s")
@@ -1,9 +1,25 @@
 import os
-import httpx
+import asyncio
 import base64
-from typing import List, Optional
+from typing import Dict, List, Optional
 from PIL import Image
 import io
+from .circuit_breaker import CircuitOpenError, breaker_for
+from .composite import compose_crops, output_size, split_composite
+from .deadline import DeadlineExceeded
+from .local_enhancer import LOCAL_ENHANCE_MAX_SIDE, local_enhancer
+from .media import media_mirror
+from .payload import output_max_side
+from .seedream_client import SeedreamError, shared_seedream_client
+
+# How detail crops are enhanced: "local" (CPU engine), "remote" (Seedream),
+# "auto" (local for inline crops or while Seedream is unavailable) or
+# "composite" (all crops packed into one Seedream call, "auto" if that fails)
+ENHANCE_MODE = os.getenv("ENHANCE_MODE", "auto").lower()
+
+# The packed canvas is requested one size up so each crop keeps roughly the
+# resolution it would get from its own call (Seedream bills per output image)
+_COMPOSITE_SIZES = {"1K": "2K", "2K": "4K"}
 
 class JewelryImageGenerator:
     def __init__(self):
@@ -14,6 +30,9 @@ class JewelryImageGenerator:
         else:
             self.has_api_key = False
             print("WARNING: No ARK_API_KEY set. Using placeholder images.")
+        self.seedream = shared_seedream_client()
+        # Cleared when Seedream rejects multi-output requests, so we stop trying
+        self.batch_supported = True
     
     async def generate_image(self, prompt: str, size: str = "1024x1024") -> str:
         """Generate a single jewelry image using Seedream 4.0"""
@@ -23,95 +42,168 @@ class JewelryImageGenerator:
             return f"https://via.placeholder.com/1024x1024/FFD700/000000?text={prompt[:30].replace(' ', '+')}"
         
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    "https://ark.ap-southeast.bytepluses.com/api/v3/images/generations",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "seedream-4-0-250828",
-                        "prompt": prompt,
-                        "size": size,
-                        "response_format": "url",
-                        "watermark": False,
-                        "n": 1
-                    }
-                )
-                
-                if response.status_code != 200:
-                    error_text = response.text
-                    print(f"Seedream API error {response.status_code}: {error_text}")
-                    return f"https://via.placeholder.com/1024x1024/FFD700/000000?text=Error+{response.status_code}"
-                
-                data = response.json()
-                
-                if "data" in data and len(data["data"]) > 0:
-                    image_url = data["data"][0].get("url")
-                    if image_url:
-                        return image_url
-                
-                print(f"No images in Seedream response: {data}")
-                return "https://via.placeholder.com/1024x1024/FFD700/000000?text=No+Image+Generated"
-                
+            return await self.seedream.generate(
+                {"prompt": prompt, "size": size, "n": 1},
+                endpoint="text-to-image",
+                timeout=120.0
+            )
+        except SeedreamError as e:
+            if e.status_code:
+                return f"https://via.placeholder.com/1024x1024/FFD700/000000?text=Error+{e.status_code}"
+            return "https://via.placeholder.com/1024x1024/FFD700/000000?text=No+Image+Generated"
+        except CircuitOpenError:
+            print("Seedream text-to-image circuit open, failing fast with placeholder")
+            return "https://via.placeholder.com/1024x1024/FFD700/000000?text=Service+Unavailable"
+        except DeadlineExceeded:
+            print("Seedream generation ran out of request budget")
+            return "https://via.placeholder.com/1024x1024/FFD700/000000?text=Timed+Out"
         except Exception as e:
             print(f"Error generating image with Seedream: {e}")
             return f"https://via.placeholder.com/1024x1024/FFD700/000000?text=Error+Generating"
     
-    async def enhance_image(self, image_url: str, prompt: str) -> str:
+    async def enhance_image(self, image_url: str, prompt: str, size: str = "2K") -> str:
         """Enhance an existing image using Seedream 4.0 image-to-image"""
         if not self.has_api_key:
             return image_url  # Return original if no API key
         
-        # If the image is a base64 data URL (from cropped regions), skip enhancement
-        # and return it as-is since it's already high quality from the 2K base image
-        if image_url.startswith("data:image"):
-            print(f"Skipping enhancement for base64 data URL (already high quality from crop)")
-            return image_url
-        
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    "https://ark.ap-southeast.bytepluses.com/api/v3/images/generations",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "seedream-4-0-250828",
-                        "prompt": prompt,
-                        "image": image_url,
-                        "size": "2K",
-                        "response_format": "url",
-                        "watermark": False,
-                        "sequential_image_generation": "disabled"
-                    }
-                )
-                
-                if response.status_code != 200:
-                    error_text = response.text
-                    print(f"Seedream enhancement error {response.status_code}: {error_text}")
-                    return image_url  # Return original on error
-                
-                data = response.json()
-                
-                if "data" in data and len(data["data"]) > 0:
-                    enhanced_url = data["data"][0].get("url")
-                    if enhanced_url:
-                        return enhanced_url
-                
-                print(f"No enhanced image in response: {data}")
-                return image_url  # Return original if no enhanced image
-                
+            return await self.seedream.generate(
+                {
+                    "prompt": prompt,
+                    "image": image_url,
+                    "size": size,
+                    "sequential_image_generation": "disabled"
+                },
+                endpoint="image-to-image",
+                timeout=120.0
+            )
+        except CircuitOpenError:
+            print("Seedream image-to-image circuit open, keeping un-enhanced image")
+            return image_url
+        except DeadlineExceeded:
+            print("Seedream enhancement ran out of request budget, keeping original")
+            return image_url  # Degrade to the un-enhanced image
         except Exception as e:
             print(f"Error enhancing image with Seedream: {e}")
             return image_url  # Return original on error
     
+    async def generate_view_set(self, prompt: str, regions: List[str], size: str = "2K",
+                                image_url: Optional[str] = None) -> Optional[List[str]]:
+        """
+        Ask Seedream for the hero view plus one close-up per detail region in a
+        single sequential (group) generation request.
+
+        Returns the image URLs in order - hero first, then `regions` in order -
+        or None when batching is unavailable. The list may be shorter than
+        requested; callers fill missing details from crops. Passing `image_url`
+        makes it an image-to-image request (used by /modify).
+        """
+        if not self.has_api_key or not self.batch_supported:
+            return None
+        
+        count = 1 + len(regions)
+        views = ["Image 1: the complete piece, centered hero product shot"] + [
+            f"Image {i + 2}: extreme macro close-up of the {name.replace('_', ' ')} of the SAME piece"
+            for i, name in enumerate(regions)
+        ]
+        payload = {
+            "prompt": f"Generate a set of {count} images of ONE and the SAME jewelry piece with identical design, materials, lighting and white background across the whole set. {'; '.join(views)}. {prompt}",
+            "size": size,
+            "sequential_image_generation": "auto",
+            "sequential_image_generation_options": {"max_images": count}
+        }
+        if image_url:
+            payload["image"] = image_url
+        
+        try:
+            # Not hedged: a duplicate would bill the whole set again
+            urls = await self.seedream.generate_many(payload, endpoint="image-set", timeout=180.0, hedge=False)
+            print(f"Batched generation returned {len(urls)}/{count} views")
+            return urls
+        except SeedreamError as e:
+            if e.status_code == 400:
+                print("Seedream rejected batched generation, using per-crop path from now on")
+                self.batch_supported = False
+            return None
+        except Exception as e:
+            print(f"Batched generation unavailable ({type(e).__name__}), using per-crop path")
+            return None
+    
+    async def enhance_crop(self, crop_url: str, prompt: str, mode: Optional[str] = None, size: str = "2K") -> str:
+        """
+        Enhance one detail crop, choosing the local CPU engine or Seedream.
+
+        In "auto" mode crops that are already inline (data: URLs from
+        crop_jewelry_regions) are enhanced locally, as is everything while there
+        is no API key or the image-to-image breaker is open; remote URLs go to
+        Seedream. `size` caps the output for either engine.
+        """
+        mode = mode or ENHANCE_MODE
+        if mode in ("auto", "composite"):
+            remote_available = self.has_api_key and breaker_for("seedream", "image-to-image").state == "closed"
+            mode = "remote" if remote_available and not crop_url.startswith("data:") else "local"
+        
+        if mode == "remote":
+            return await self.enhance_image(crop_url, prompt, size=size)
+        
+        try:
+            if not crop_url.startswith("data:"):
+                content_type, data = await media_mirror.read(crop_url)
+                crop_url = f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+            return await local_enhancer.enhance(crop_url, max_side=min(LOCAL_ENHANCE_MAX_SIDE, output_max_side(size)))
+        except Exception as e:
+            print(f"Local enhancement failed, keeping original crop: {e}")
+            return crop_url
+    
+    async def enhance_crops_composite(self, crops: Dict[str, str], prompt: str,
+                                      size: str = "2K") -> Optional[Dict[str, str]]:
+        """
+        Enhance several inline crops with a single image-to-image call.
+
+        The crops are packed into one canvas with white gutters, enhanced
+        together and cut apart again using the recorded layout. Returns
+        {region: data URL}, or None when Seedream is unavailable or any step
+        fails so the caller can fall back to per-crop enhancement.
+        """
+        if not self.has_api_key or len(crops) < 2:
+            return None
+        if breaker_for("seedream", "image-to-image").state != "closed":
+            return None
+        if not all(url.startswith("data:") for url in crops.values()):
+            return None
+        
+        try:
+            crop_bytes = {name: base64.b64decode(url.split(",", 1)[1]) for name, url in crops.items()}
+            canvas, layout = await asyncio.to_thread(compose_crops, crop_bytes)
+            composite_prompt = (
+                f"This image is a contact sheet of {len(crops)} separate close-up photos of the same jewelry, "
+                "separated by plain white gutters. Enhance every panel in place. Keep the panel positions, sizes "
+                "and white gutters exactly as they are; never let one panel spill into another. "
+                f"{prompt}"
+            )
+            result_url = await self.seedream.generate(
+                {
+                    "prompt": composite_prompt,
+                    "image": f"data:image/png;base64,{base64.b64encode(canvas).decode('utf-8')}",
+                    # Explicit W x H with the canvas' aspect, so the tile boxes still line up
+                    "size": output_size(layout, _COMPOSITE_SIZES.get(size, size)),
+                    "sequential_image_generation": "disabled"
+                },
+                endpoint="image-to-image",
+                timeout=120.0,
+                hedge=False  # A duplicate 4K render would cost as much as the fan-out it replaces
+            )
+            _, result = await media_mirror.read(result_url)
+            tiles = await asyncio.to_thread(split_composite, result, layout)
+            if tiles is None:
+                return None
+            print(f"Enhanced {len(tiles)} crops in one composite call")
+            return {name: f"data:image/png;base64,{base64.b64encode(data).decode('utf-8')}" for name, data in tiles.items()}
+        except Exception as e:
+            print(f"Composite enhancement failed ({type(e).__name__}: {e}), enhancing crops one by one")
+            return None
+    
     async def download_image(self, url: str) -> Image.Image:
         """Download an image from URL and return as PIL Image"""
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            image_bytes = response.content
-            return Image.open(io.BytesIO(image_bytes))
+        _, image_bytes = await media_mirror.read(url)
+        return Image.open(io.BytesIO(image_bytes))
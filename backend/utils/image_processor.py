@@ -1,133 +1,153 @@
 import os
+import asyncio
 from PIL import Image, ImageFilter, ImageOps, ImageEnhance
 import io
 import httpx
-import cv2
-import numpy as np
 from typing import Optional
 import base64
 from .hitem3d_client import Hitem3DClient
+from .circuit_breaker import CircuitOpenError
+from .deadline import DeadlineExceeded
+from .media import media_mirror
+from .payload import PAYLOAD_MINIMIZE
+from .seedream_client import SeedreamError, shared_seedream_client
 
 class ImageProcessor:
     def __init__(self):
         self.api_key = os.getenv("ARK_API_KEY")
         self.has_api_key = bool(self.api_key)
         self.hitem3d_client = Hitem3DClient()
+        self.seedream = shared_seedream_client()
     
     async def crop_jewelry_regions(self, image_url: str, jewelry_type: str = "necklace") -> dict:
         """Crop specific regions from the base jewelry image for detail enhancement"""
         try:
             # Download the image
             img_bytes = await self._download_image(image_url)
-            img = Image.open(io.BytesIO(img_bytes))
-            width, height = img.size
-            
-            # Define crop regions based on jewelry type
-            # Format: (left, top, right, bottom) as percentages of image size
-            # Ensuring aspect ratios between 0.33 and 3.00 (Seedream API requirement)
-            if "necklace" in jewelry_type.lower() or "pendant" in jewelry_type.lower():
-                crops = {
-                    "pendant": (0.25, 0.30, 0.75, 0.70),   # Center pendant area - larger crop
-                    "chain": (0.20, 0.10, 0.80, 0.45),     # Upper chain section - wider crop
-                    "clasp": (0.20, 0.55, 0.80, 0.90)      # Lower clasp area - wider crop
-                }
-            elif "ring" in jewelry_type.lower():
-                crops = {
-                    "gemstone": (0.30, 0.25, 0.70, 0.65),  # Center gemstone (1:1 ratio)
-                    "band": (0.30, 0.45, 0.70, 0.75),      # Ring band (4:3 ratio)
-                    "side_detail": (0.25, 0.30, 0.60, 0.70) # Side profile (1:1 ratio)
-                }
-            elif "bracelet" in jewelry_type.lower():
-                crops = {
-                    "center_link": (0.30, 0.30, 0.70, 0.70),  # Center link (1:1 ratio)
-                    "clasp": (0.60, 0.35, 0.90, 0.65),        # Clasp (1:1 ratio)
-                    "pattern": (0.25, 0.35, 0.60, 0.70)       # Pattern detail (1:1 ratio)
-                }
-            else:
-                # Default: square crops for safety (1:1 ratio)
-                crops = {
-                    "center": (0.25, 0.25, 0.75, 0.75),      # Main center (1:1)
-                    "detail_1": (0.30, 0.30, 0.70, 0.70),    # Detail 1 (1:1)
-                    "detail_2": (0.35, 0.35, 0.65, 0.65)     # Detail 2 (1:1)
-                }
-            
-            # Perform crops and convert to base64
-            cropped_images = {}
-            for region_name, (left_pct, top_pct, right_pct, bottom_pct) in crops.items():
-                left = int(width * left_pct)
-                top = int(height * top_pct)
-                right = int(width * right_pct)
-                bottom = int(height * bottom_pct)
-                
-                crop_width = right - left
-                crop_height = bottom - top
-                
-                # Validate aspect ratio (must be between 0.33 and 3.00)
-                if crop_width > 0 and crop_height > 0:
-                    aspect_ratio = crop_width / crop_height
-                    if aspect_ratio < 0.33 or aspect_ratio > 3.00:
-                        print(f"Warning: Crop '{region_name}' has invalid aspect ratio {aspect_ratio:.2f}, adjusting to 1:1")
-                        # Adjust to square (1:1) to be safe
-                        size = min(crop_width, crop_height)
-                        center_x = (left + right) // 2
-                        center_y = (top + bottom) // 2
-                        left = center_x - size // 2
-                        right = center_x + size // 2
-                        top = center_y - size // 2
-                        bottom = center_y + size // 2
-                
-                cropped = img.crop((left, top, right, bottom))
-                
-                # Convert to base64 data URL for API
-                buffer = io.BytesIO()
-                cropped.save(buffer, format="PNG")
-                img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                
-                cropped_images[region_name] = f"data:image/png;base64,{img_base64}"
-                
-                # Log the crop for debugging
-                print(f"Cropped '{region_name}': {cropped.size[0]}x{cropped.size[1]} (aspect ratio: {cropped.size[0]/cropped.size[1]:.2f})")
-            
-            return cropped_images
+            # Decoding, cropping and PNG encoding are CPU work; keep them off the event loop
+            return await asyncio.to_thread(self._crop_regions, img_bytes, jewelry_type)
         except Exception as e:
             print(f"Error cropping jewelry regions: {e}")
             import traceback
             traceback.print_exc()
             return {}
     
-    async def create_sketch(self, image_url: str) -> str:
-        """Create a sketch from a jewelry render using OpenCV edge detection"""
-        try:
-            img_bytes = await self._download_image(image_url)
-            
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    def detail_regions(self, jewelry_type: str) -> dict:
+        """Named detail regions for a jewelry type, as (left, top, right, bottom) fractions"""
+        # Define crop regions based on jewelry type
+        # Format: (left, top, right, bottom) as percentages of image size
+        # Ensuring aspect ratios between 0.33 and 3.00 (Seedream API requirement)
+        if "necklace" in jewelry_type.lower() or "pendant" in jewelry_type.lower():
+            return {
+                "pendant": (0.25, 0.30, 0.75, 0.70),   # Center pendant area - larger crop
+                "chain": (0.20, 0.10, 0.80, 0.45),     # Upper chain section - wider crop
+                "clasp": (0.20, 0.55, 0.80, 0.90)      # Lower clasp area - wider crop
+            }
+        elif "ring" in jewelry_type.lower():
+            return {
+                "gemstone": (0.30, 0.25, 0.70, 0.65),  # Center gemstone (1:1 ratio)
+                "band": (0.30, 0.45, 0.70, 0.75),      # Ring band (4:3 ratio)
+                "side_detail": (0.25, 0.30, 0.60, 0.70) # Side profile (1:1 ratio)
+            }
+        elif "bracelet" in jewelry_type.lower():
+            return {
+                "center_link": (0.30, 0.30, 0.70, 0.70),  # Center link (1:1 ratio)
+                "clasp": (0.60, 0.35, 0.90, 0.65),        # Clasp (1:1 ratio)
+                "pattern": (0.25, 0.35, 0.60, 0.70)       # Pattern detail (1:1 ratio)
+            }
+        else:
+            # Default: square crops for safety (1:1 ratio)
+            return {
+                "center": (0.25, 0.25, 0.75, 0.75),      # Main center (1:1)
+                "detail_1": (0.30, 0.30, 0.70, 0.70),    # Detail 1 (1:1)
+                "detail_2": (0.35, 0.35, 0.65, 0.65)     # Detail 2 (1:1)
+            }
+    
+    def _crop_regions(self, img_bytes: bytes, jewelry_type: str) -> dict:
+        """Blocking half of crop_jewelry_regions: crop the downloaded image into base64 PNG regions"""
+        img = Image.open(io.BytesIO(img_bytes))
+        width, height = img.size
+        
+        crops = self.detail_regions(jewelry_type)
+        
+        # Perform crops and convert to base64
+        cropped_images = {}
+        for region_name, (left_pct, top_pct, right_pct, bottom_pct) in crops.items():
+            left = int(width * left_pct)
+            top = int(height * top_pct)
+            right = int(width * right_pct)
+            bottom = int(height * bottom_pct)
             
-            # Apply Gaussian blur for smoother edges
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+            crop_width = right - left
+            crop_height = bottom - top
             
-            # Apply adaptive thresholding for better sketch effect
-            thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                          cv2.THRESH_BINARY, 11, 2)
+            # Validate aspect ratio (must be between 0.33 and 3.00)
+            if crop_width > 0 and crop_height > 0:
+                aspect_ratio = crop_width / crop_height
+                if aspect_ratio < 0.33 or aspect_ratio > 3.00:
+                    print(f"Warning: Crop '{region_name}' has invalid aspect ratio {aspect_ratio:.2f}, adjusting to 1:1")
+                    # Adjust to square (1:1) to be safe
+                    size = min(crop_width, crop_height)
+                    center_x = (left + right) // 2
+                    center_y = (top + bottom) // 2
+                    left = center_x - size // 2
+                    right = center_x + size // 2
+                    top = center_y - size // 2
+                    bottom = center_y + size // 2
             
-            # Detect edges using Canny
-            edges = cv2.Canny(blurred, 30, 100)
+            cropped = img.crop((left, top, right, bottom))
             
-            # Combine threshold and edges for pencil sketch effect
-            sketch = cv2.bitwise_and(thresh, cv2.bitwise_not(edges))
+            # Convert to base64 data URL for API
+            buffer = io.BytesIO()
+            cropped.save(buffer, format="PNG")
+            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
             
-            # Encode as PNG
-            _, buffer = cv2.imencode('.png', sketch)
-            sketch_base64 = base64.b64encode(buffer).decode('utf-8')
+            cropped_images[region_name] = f"data:image/png;base64,{img_base64}"
             
-            return f"data:image/png;base64,{sketch_base64}"
+            # Log the crop for debugging
+            print(f"Cropped '{region_name}': {cropped.size[0]}x{cropped.size[1]} (aspect ratio: {cropped.size[0]/cropped.size[1]:.2f})")
+        
+        return cropped_images
+    
+    async def create_sketch(self, image_url: str) -> str:
+        """Create a sketch from a jewelry render using OpenCV edge detection"""
+        try:
+            img_bytes = await self._download_image(image_url)
+            return await asyncio.to_thread(self._sketch_from_bytes, img_bytes)
         except Exception as e:
             print(f"Error creating sketch: {e}")
             return "https://via.placeholder.com/1024x1024/FFFFFF/000000?text=Sketch+Error"
     
+    def _sketch_from_bytes(self, img_bytes: bytes) -> str:
+        """Blocking OpenCV half of create_sketch"""
+        import cv2
+        import numpy as np
+        
+        nparr = np.frombuffer(img_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        
+        # Convert to grayscale
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        
+        # Apply Gaussian blur for smoother edges
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        
+        # Apply adaptive thresholding for better sketch effect
+        thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                      cv2.THRESH_BINARY, 11, 2)
+        
+        # Detect edges using Canny
+        edges = cv2.Canny(blurred, 30, 100)
+        
+        # Combine threshold and edges for pencil sketch effect
+        sketch = cv2.bitwise_and(thresh, cv2.bitwise_not(edges))
+        
+        # Encode as PNG
+        _, buffer = cv2.imencode('.png', sketch)
+        sketch_base64 = base64.b64encode(buffer).decode('utf-8')
+        
+        return f"data:image/png;base64,{sketch_base64}"
+    
     async def create_sketches_from_renders(self, images: list) -> list:
         """Create sketches from existing rendered images using OpenCV edge detection"""
         try:
@@ -226,46 +246,36 @@ class ImageProcessor:
                     
                     print(f"Converting '{img_data['angle']}' to technical drawing...")
                     
-                    # Set longer timeout for base64 images (they're larger)
-                    timeout_duration = 180.0 if image_url.startswith("data:image") else 120.0
+                    # Inline images only need a longer timeout when they are sent unminimized
+                    timeout_duration = 180.0 if image_url.startswith("data:image") and not PAYLOAD_MINIMIZE else 120.0
                     
-                    async with httpx.AsyncClient(timeout=timeout_duration) as client:
-                        response = await client.post(
-                            "https://ark.ap-southeast.bytepluses.com/api/v3/images/generations",
-                            headers={
-                                "Authorization": f"Bearer {self.api_key}",
-                                "Content-Type": "application/json"
-                            },
-                            json={
-                                "model": "seedream-4-0-250828",
+                    try:
+                        sketch_url = await self.seedream.generate(
+                            {
                                 "prompt": sketch_prompt,
                                 "negative_prompt": negative_prompt,
                                 "image": image_url,  # Image-to-image input
                                 "size": "1024x1024",
-                                "response_format": "url",
-                                "watermark": False,
                                 "n": 1
-                            }
+                            },
+                            endpoint="sketch",
+                            timeout=timeout_duration
                         )
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            print(f"Sketch API response for '{img_data['angle']}': {data}")
-                            if "data" in data and len(data["data"]) > 0:
-                                sketch_url = data["data"][0].get("url")
-                                if sketch_url:
-                                    print(f"Sketch created for '{img_data['angle']}': {sketch_url[:100]}...")
-                                    return {"angle": img_data["angle"], "url": sketch_url}
-                            else:
-                                print(f"No sketch data in response for '{img_data['angle']}'")
-                        
-                        print(f"Failed to create sketch for '{img_data['angle']}': {response.status_code}")
-                        if response.text:
-                            print(f"Error details: {response.text[:500]}")
-                        return {
-                            "angle": img_data["angle"],
-                            "url": image_url  # Fallback to original image
-                        }
+                        print(f"Sketch created for '{img_data['angle']}': {sketch_url[:100]}...")
+                        return {"angle": img_data["angle"], "url": sketch_url}
+                    except CircuitOpenError:
+                        # Seedream is degraded: render the sketch locally instead of waiting on it
+                        print(f"Sketch circuit open, rendering '{img_data['angle']}' sketch locally")
+                        return {"angle": img_data["angle"], "url": await self.create_sketch(image_url)}
+                    except DeadlineExceeded:
+                        print(f"Out of request budget for '{img_data['angle']}' sketch, keeping original")
+                    except SeedreamError as e:
+                        print(f"Failed to create sketch for '{img_data['angle']}': {e}")
+                    
+                    return {
+                        "angle": img_data["angle"],
+                        "url": image_url  # Fallback to original image
+                    }
                 except Exception as e:
                     print(f"Error converting {img_data['angle']} to sketch: {e}")
                     import traceback
@@ -332,6 +342,9 @@ class ImageProcessor:
     
     async def _download_image(self, url: str) -> bytes:
         """Download image from URL"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            return response.content
+        if url.startswith("data:"):
+            # Inline crops (e.g. local sketch fallback) need no network round-trip
+            return base64.b64decode(url.split(",", 1)[1])
+        # Upstream images are read from the local mirror (one upstream fetch, no expired links)
+        _, data = await media_mirror.read(url)
+        return data
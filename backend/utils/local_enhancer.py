@@ -0,0 +1,200 @@
+import asyncio
+import base64
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from .matting import BG_DISTANCE
+
+
+# Upscale factor for crops and the largest output side allowed (4K)
+LOCAL_ENHANCE_SCALE = float(os.getenv("LOCAL_ENHANCE_SCALE", "2.0"))
+LOCAL_ENHANCE_MAX_SIDE = int(os.getenv("LOCAL_ENHANCE_MAX_SIDE", "4096"))
+LOCAL_ENHANCE_WORKERS = int(os.getenv("LOCAL_ENHANCE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+# Output tile edge in pixels; peak working memory per tile is a few times TILE^2
+TILE = 512
+# Extra output pixels rendered around each tile so filters have no seams at tile edges
+TILE_MARGIN = 16
+# Luminance above which pixels (speculars, the white backdrop) are left alone
+HIGHLIGHT_LEVEL = 235
+# Largest contrast gain the tone curve applies to the object's luminance range;
+# stronger stretches visibly shift product colour (gold turns brown)
+LOCAL_ENHANCE_MAX_GAIN = float(os.getenv("LOCAL_ENHANCE_MAX_GAIN", "1.2"))
+# Objects with a narrower luminance spread, or fewer thumbnail pixels, keep their tones
+TONE_MIN_RANGE = 24
+TONE_MIN_SAMPLES = 64
+
+
+def _object_luminance(thumb, thumb_alpha):
+    """Luminance of the thumbnail pixels that belong to the object rather than the backdrop"""
+    import cv2
+    import numpy as np
+
+    luminance = cv2.cvtColor(thumb, cv2.COLOR_BGR2LAB)[..., 0]
+    if thumb_alpha is not None:
+        return luminance[thumb_alpha >= 128]
+    pixels = thumb.astype(np.float32)
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    backdrop = np.median(border, axis=0)
+    if (np.sqrt(((border - backdrop) ** 2).sum(axis=1)) < BG_DISTANCE).mean() < 0.8:
+        return luminance.ravel()  # No plain backdrop: the crop is all object
+    return luminance[np.sqrt(((pixels - backdrop) ** 2).sum(axis=2)) >= BG_DISTANCE]
+
+
+def _tone_curve(luminance_sample):
+    """
+    Contrast LUT for the object's luminance: its p1..p99 range is stretched
+    about its mid-tone by at most LOCAL_ENHANCE_MAX_GAIN. Levels from
+    HIGHLIGHT_LEVEL up map to themselves; too few or too flat samples (a
+    light piece on white) get the identity.
+    """
+    import numpy as np
+
+    levels = np.arange(256, dtype=np.float32)
+    identity = levels.astype(np.uint8)
+    if luminance_sample.size < TONE_MIN_SAMPLES:
+        return identity
+    low, high = np.percentile(luminance_sample, (1, 99))
+    high = min(high, HIGHLIGHT_LEVEL - 1)
+    if high < low + TONE_MIN_RANGE:
+        return identity
+
+    gain = min(LOCAL_ENHANCE_MAX_GAIN, (HIGHLIGHT_LEVEL - 1) / (high - low))
+    mid = (low + high) / 2
+    out_low = max(0.0, mid - (mid - low) * gain)
+    out_high = min(HIGHLIGHT_LEVEL - 1.0, mid + (high - mid) * gain)
+    curve = np.interp(levels, [0, low, high, HIGHLIGHT_LEVEL, 255], [0, out_low, out_high, HIGHLIGHT_LEVEL, 255])
+    return np.clip(np.round(curve), 0, 255).astype(np.uint8)
+
+
+def _enhance_tile(tile, curve):
+    """Denoise, sharpen and apply the tone curve to one BGR uint8 tile"""
+    import cv2
+
+    denoised = cv2.bilateralFilter(tile, d=5, sigmaColor=20, sigmaSpace=5)
+    blurred = cv2.GaussianBlur(denoised, (0, 0), 1.2)
+    sharpened = cv2.addWeighted(denoised, 1.6, blurred, -0.6, 0)
+
+    lab = cv2.cvtColor(sharpened, cv2.COLOR_BGR2LAB)
+    toned = cv2.LUT(lab[..., 0], curve)
+    # Only pixels the curve moved go through the lossy 8-bit Lab round trip,
+    # so the backdrop and highlights keep their exact values
+    changed = toned != lab[..., 0]
+    lab[..., 0] = toned
+    sharpened[changed] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)[changed]
+    return sharpened
+
+
+def enhance_image_bytes(image_bytes: bytes, scale: float = LOCAL_ENHANCE_SCALE,
+                        max_side: int = LOCAL_ENHANCE_MAX_SIDE, tile: int = TILE) -> bytes:
+    """
+    Tiled local detail enhancement: Lanczos upscale, denoise, sharpen and a
+    mild contrast curve fitted to the object (not the backdrop) that leaves
+    highlights alone. Returns PNG bytes.
+
+    Work is done one output tile at a time (with a small overlap margin), so
+    beyond the output buffer itself memory stays bounded by the tile size.
+    CPU bound - run in a worker process.
+    """
+    import cv2
+    import numpy as np
+
+    src = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_UNCHANGED)
+    if src is None:
+        raise ValueError("Could not decode image")
+    if src.ndim == 2:
+        src = cv2.cvtColor(src, cv2.COLOR_GRAY2BGR)
+    alpha = src[..., 3] if src.shape[2] == 4 else None
+    color = src[..., :3]
+
+    src_h, src_w = color.shape[:2]
+    scale = min(scale, max_side / max(src_h, src_w))
+    scale = max(scale, 1.0)
+    out_w, out_h = int(round(src_w * scale)), int(round(src_h * scale))
+
+    # Tone curve from a small thumbnail so every tile uses the same mapping
+    thumb_size = (max(1, src_w // 8), max(1, src_h // 8))
+    thumb = cv2.resize(color, thumb_size, interpolation=cv2.INTER_AREA)
+    thumb_alpha = None if alpha is None else cv2.resize(alpha, thumb_size, interpolation=cv2.INTER_AREA)
+    curve = _tone_curve(_object_luminance(thumb, thumb_alpha))
+
+    output = np.empty((out_h, out_w, 3 if alpha is None else 4), np.uint8)
+    # Source coordinate of every output column / row, with cv2.resize's
+    # half-pixel convention. Tiles sample these same coordinates (shifted by
+    # an integer window origin, which is exact in float32), so a tiled run
+    # is pixel-for-pixel identical to a single tile at any scale.
+    src_x = ((np.arange(out_w) + 0.5) * (src_w / out_w) - 0.5).astype(np.float32)
+    src_y = ((np.arange(out_h) + 0.5) * (src_h / out_h) - 0.5).astype(np.float32)
+    reach = 4  # Lanczos4 taps on either side of a sample
+
+    for top in range(0, out_h, tile):
+        for left in range(0, out_w, tile):
+            bottom, right = min(top + tile, out_h), min(left + tile, out_w)
+            # Render the tile plus a margin so the filters have no seams at tile edges
+            r_top, r_left = max(0, top - TILE_MARGIN), max(0, left - TILE_MARGIN)
+            r_bottom, r_right = min(out_h, bottom + TILE_MARGIN), min(out_w, right + TILE_MARGIN)
+            # Source window covering every tap of the rendered area
+            s_top = max(0, int(np.floor(src_y[r_top])) - reach)
+            s_left = max(0, int(np.floor(src_x[r_left])) - reach)
+            s_bottom = min(src_h, int(np.ceil(src_y[r_bottom - 1])) + reach + 1)
+            s_right = min(src_w, int(np.ceil(src_x[r_right - 1])) + reach + 1)
+
+            map_x, map_y = np.meshgrid(src_x[r_left:r_right] - np.float32(s_left),
+                                       src_y[r_top:r_bottom] - np.float32(s_top))
+            window = cv2.remap(color[s_top:s_bottom, s_left:s_right], map_x, map_y,
+                               interpolation=cv2.INTER_LANCZOS4, borderMode=cv2.BORDER_REPLICATE)
+            window = _enhance_tile(window, curve)
+
+            y0, x0 = top - r_top, left - r_left
+            output[top:bottom, left:right, :3] = window[y0:y0 + (bottom - top), x0:x0 + (right - left)]
+
+            if alpha is not None:
+                a_window = cv2.remap(alpha[s_top:s_bottom, s_left:s_right], map_x, map_y,
+                                     interpolation=cv2.INTER_LANCZOS4, borderMode=cv2.BORDER_REPLICATE)
+                output[top:bottom, left:right, 3] = a_window[y0:y0 + (bottom - top), x0:x0 + (right - left)]
+
+    ok, buffer = cv2.imencode(".png", output)
+    if not ok:
+        raise ValueError("Could not encode enhanced image")
+    return buffer.tobytes()
+
+
+def _enhance_data_url(data_url: str, max_side: int = LOCAL_ENHANCE_MAX_SIDE) -> str:
+    """Process-pool entry point: data URL in, enhanced PNG data URL out"""
+    encoded = data_url.split(",", 1)[1]
+    enhanced = enhance_image_bytes(base64.b64decode(encoded), max_side=max_side)
+    return f"data:image/png;base64,{base64.b64encode(enhanced).decode('utf-8')}"
+
+
+class LocalEnhancer:
+    """Runs local crop enhancement in a small process pool"""
+
+    def __init__(self, workers: int = LOCAL_ENHANCE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Fresh interpreters: forking here would copy the loop watchdog and HTTP pool threads' locks
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def warm_up(self):
+        """Start the worker processes ahead of the first request"""
+        futures = [self.pool.submit(os.getpid) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    async def enhance(self, data_url: str, max_side: int = LOCAL_ENHANCE_MAX_SIDE) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, _enhance_data_url, data_url, max_side)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+local_enhancer = LocalEnhancer()
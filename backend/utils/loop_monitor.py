@@ -0,0 +1,169 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+# How often the event loop is sampled for scheduling lag (seconds)
+LOOP_SAMPLE_INTERVAL = float(os.getenv("LOOP_SAMPLE_INTERVAL", "0.1"))
+# A callback holding the loop longer than this is reported with its stack
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.25"))
+# Debug mode: raise LoopBlockedError from check() when the loop was blocked
+LOOP_MONITOR_STRICT = os.getenv("LOOP_MONITOR_STRICT", "false").lower() in ("1", "true", "yes")
+
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopBlockedError(AssertionError):
+    """The event loop was blocked longer than the threshold (debug mode / tests)"""
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and catches callbacks that block the loop.
+
+    A coroutine on the loop sleeps for a fixed interval and records how late it
+    wakes up (scheduling lag) while refreshing a heartbeat. A watchdog thread
+    notices when the heartbeat stops advancing for longer than the threshold
+    and captures the loop thread's stack at that moment, which points straight
+    at the blocking call.
+    """
+
+    def __init__(self, interval: float = LOOP_SAMPLE_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.samples = 0
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+        self.bucket_counts = [0] * len(LAG_BUCKETS)
+        self.recent_lags = deque(maxlen=600)
+        self.blocked_events = deque(maxlen=50)
+        self.blocked_total = 0
+        self._current_block = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start sampling on the running loop and the watchdog thread"""
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            self._record_lag(max(0.0, now - expected))
+
+    def _record_lag(self, lag: float):
+        self.samples += 1
+        self.lag_sum += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.recent_lags.append(lag)
+        for i, bound in enumerate(LAG_BUCKETS):
+            if lag <= bound:
+                self.bucket_counts[i] += 1
+
+    def _watch(self):
+        poll = max(0.01, self.threshold / 4)
+        while not self._stop.wait(poll):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled > self.threshold and self._current_block is None:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                self._current_block = {"detected_at": time.time(), "last_heartbeat": self.heartbeat, "stack": stack}
+                print(f"Event loop blocked for >{self.threshold * 1000:.0f}ms at:\n{stack}")
+            elif stalled <= self.threshold and self._current_block is not None:
+                self._finish_block()
+
+    def _finish_block(self):
+        block, self._current_block = self._current_block, None
+        last_heartbeat = block.pop("last_heartbeat")
+        block["blocked_seconds"] = round(max(0.0, self.heartbeat - last_heartbeat - self.interval), 3)
+        self.blocked_events.append(block)
+        self.blocked_total += 1
+
+    def check(self, since: int = 0):
+        """In strict mode, raise LoopBlockedError if the loop blocked after event number `since`"""
+        if LOOP_MONITOR_STRICT and self.blocked_total > since:
+            latest = self.blocked_events[-1]
+            raise LoopBlockedError(f"Event loop blocked; last stack:\n{latest['stack']}")
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.recent_lags)
+        p99 = recent[int(0.99 * (len(recent) - 1))] if recent else 0.0
+        return {
+            "samples": self.samples,
+            "lag_mean_seconds": round(self.lag_sum / self.samples, 4) if self.samples else 0.0,
+            "lag_p99_seconds": round(p99, 4),
+            "lag_max_seconds": round(self.lag_max, 4),
+            "blocked_total": self.blocked_total,
+            "block_threshold_seconds": self.threshold,
+            "recent_blocks": list(self.blocked_events)[-5:],
+        }
+
+    def prometheus(self) -> str:
+        """Metrics in Prometheus text exposition format"""
+        lines = [
+            "# HELP event_loop_lag_seconds Event loop scheduling lag",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        for bound, count in zip(LAG_BUCKETS, self.bucket_counts):
+            lines.append(f'event_loop_lag_seconds_bucket{{le="{bound}"}} {count}')
+        lines += [
+            f'event_loop_lag_seconds_bucket{{le="+Inf"}} {self.samples}',
+            f"event_loop_lag_seconds_sum {self.lag_sum:.6f}",
+            f"event_loop_lag_seconds_count {self.samples}",
+            "# HELP event_loop_lag_max_seconds Largest lag observed since start",
+            "# TYPE event_loop_lag_max_seconds gauge",
+            f"event_loop_lag_max_seconds {self.lag_max:.6f}",
+            "# HELP event_loop_blocked_total Callbacks that blocked the loop past the threshold",
+            "# TYPE event_loop_blocked_total counter",
+            f"event_loop_blocked_total {self.blocked_total}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+loop_monitor = LoopMonitor()
+
+
+@asynccontextmanager
+async def detect_blocking(threshold: float = LOOP_BLOCK_THRESHOLD):
+    """
+    Fail a test if anything inside the block stalls the event loop.
+
+        async with detect_blocking(0.05):
+            await image_processor.crop_jewelry_regions(url)
+    """
+    monitor = LoopMonitor(interval=min(LOOP_SAMPLE_INTERVAL, threshold / 2), threshold=threshold)
+    monitor.start()
+    try:
+        yield monitor
+        await asyncio.sleep(monitor.interval * 2)  # let the watchdog see the last sample
+    finally:
+        monitor.stop()
+        if monitor._current_block is not None:
+            monitor._finish_block()
+    if monitor.blocked_total:
+        raise LoopBlockedError(
+            f"Event loop blocked {monitor.blocked_total} time(s); first stack:\n{monitor.blocked_events[0]['stack']}"
+        )
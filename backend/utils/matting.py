@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# cv2, numpy and rembg (onnxruntime) are imported on first use so that importing
+# this module stays cheap; warm-up preloads them in the background.
+
+
+# "auto" tries the fast white-background matte and only falls back to rembg for
+# hard cases; "fast" and "rembg" force one path.
+MATTING_MODE = os.getenv("MATTING_MODE", "auto").lower()
+MATTING_MIN_QUALITY = float(os.getenv("MATTING_MIN_QUALITY", "0.7"))
+
+# Colour distance (0-441 in RGB) below which a pixel is treated as background
+BG_DISTANCE = 22.0
+# Colour distance at which an edge pixel becomes fully opaque
+FG_DISTANCE = 70.0
+# Enclosed background-coloured regions smaller than this (fraction of the image)
+# are always treated as specular highlights and stay opaque.
+HOLE_MIN_AREA = 0.0005
+# A larger region is a hole (ring centre, chain loop) only when the band of object
+# around it is thin: its gap to the outer backdrop is at most HOLE_MAX_BAND times
+# the region's radius. Regions deeper than HIGHLIGHT_MIN_BAND radii inside the
+# object are blown-out highlights; anything in between is ambiguous, stays opaque
+# and zeroes the quality score so rembg decides.
+HOLE_MAX_BAND = 0.5
+HIGHLIGHT_MIN_BAND = 1.0
+FEATHER_SIGMA = 1.0
+EDGE_BAND = 2
+
+REMBG_OPTIONS = {
+    "alpha_matting": True,
+    "alpha_matting_foreground_threshold": 240,
+    "alpha_matting_background_threshold": 10,
+    "alpha_matting_erode_size": 10,
+}
+
+
+_rembg_session = None
+_rembg_lock = threading.Lock()
+
+
+def get_rembg_session():
+    """Load the rembg ONNX model once per process"""
+    global _rembg_session
+    if _rembg_session is None:
+        with _rembg_lock:
+            if _rembg_session is None:
+                from rembg import new_session
+                _rembg_session = new_session()
+    return _rembg_session
+
+
+def _border_pixels(img):
+    import numpy as np
+    return np.concatenate([img[0, :], img[-1, :], img[:, 0], img[:, -1]])
+
+
+def white_background_matte(img) -> Tuple["np.ndarray", float]:
+    """
+    Compute an alpha channel for a product shot on a plain light background.
+
+    Pixels close in colour to the background are flood-filled from the image
+    border. Enclosed background-coloured regions are cleared as holes only
+    when large and ring-like (ring centres, chain loops: a thin band of object
+    between them and the outside); highlights inside the object stay opaque.
+    Edges get a soft ramp by colour distance plus a light feather.
+
+    Returns (alpha uint8 HxW, quality score 0-1). A low score means the image
+    does not look like a clean plain-background shot and needs a learned matte.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = img.shape[:2]
+    pixels = img.astype(np.float32)
+
+    bg_color = np.median(_border_pixels(pixels), axis=0)
+    distance = np.sqrt(((pixels - bg_color) ** 2).sum(axis=2))
+
+    candidate = (distance < BG_DISTANCE).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(candidate, connectivity=4)
+
+    border_labels = np.unique(_border_pixels(labels))
+    is_background = np.zeros(count, dtype=bool)
+    is_background[border_labels] = True
+    is_background[0] = False  # label 0 is the non-candidate (foreground) pixels
+    outside = is_background[labels]
+
+    # Hole candidates must be large and as flat in colour as the backdrop itself
+    areas = stats[:, cv2.CC_STAT_AREA]
+    mean_distance = np.bincount(labels.ravel(), weights=distance.ravel(), minlength=count)
+    mean_distance /= np.maximum(areas, 1)
+    enclosed = np.flatnonzero(
+        (areas >= HOLE_MIN_AREA * height * width) & (mean_distance < BG_DISTANCE / 2) & ~is_background
+    )
+    gap_to_outside = cv2.distanceTransform((~outside).astype(np.uint8), cv2.DIST_L2, 5)
+    ambiguous = False
+    for label in enclosed[enclosed != 0]:
+        x, y, w, h = stats[label, :4]
+        region = labels[y:y + h, x:x + w] == label
+        band = float(gap_to_outside[y:y + h, x:x + w][region].min()) / np.sqrt(areas[label] / np.pi)
+        if band <= HOLE_MAX_BAND:
+            is_background[label] = True
+        elif band <= HIGHLIGHT_MIN_BAND:
+            ambiguous = True
+    background = is_background[labels] & (candidate == 1)
+
+    foreground = (~background).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * EDGE_BAND + 1, 2 * EDGE_BAND + 1))
+    band = (cv2.dilate(foreground, kernel) != cv2.erode(foreground, kernel))
+
+    # Soft edges: foreground edge pixels keep their colour-distance ramp (so
+    # anti-aliased chain links stay intact); the background side is feathered.
+    alpha = foreground.astype(np.float32)
+    ramp = np.clip((distance - BG_DISTANCE / 2) / (FG_DISTANCE - BG_DISTANCE / 2), 0.0, 1.0)
+    alpha[band] = ramp[band]
+    feathered = cv2.GaussianBlur(alpha, (0, 0), FEATHER_SIGMA)
+    outer = band & background
+    alpha[outer] = np.maximum(alpha[outer], feathered[outer] * 0.5)
+
+    # Quality: a clean shot has a uniform light border, a sensible amount of
+    # foreground, no enclosed region that is neither clearly a hole nor clearly
+    # a highlight, and no soft transitions away from the opaque object, which
+    # would be shadows or background gradients that only a learned matte handles.
+    border_distance = np.sqrt(((_border_pixels(pixels) - bg_color) ** 2).sum(axis=1))
+    border_clean = float((border_distance < BG_DISTANCE).mean())
+    whiteness = float(np.clip((bg_color.min() - 180.0) / 60.0, 0.0, 1.0))
+    coverage = float(foreground.mean())
+    coverage_ok = 1.0 if 0.005 <= coverage <= 0.85 else 0.0
+    core = (distance >= FG_DISTANCE).astype(np.uint8)
+    near_core = cv2.dilate(core, kernel).astype(bool)
+    soft = (distance >= BG_DISTANCE) & (distance < FG_DISTANCE) & ~near_core
+    stray = float(soft.sum()) / max(1.0, float(foreground.sum()))
+    softness_ok = float(np.clip(1.0 - stray / 0.05, 0.0, 1.0))
+
+    holes_ok = 0.0 if ambiguous else 1.0
+    score = min(border_clean, whiteness, coverage_ok, softness_ok, holes_ok)
+    return (alpha * 255).astype(np.uint8), score
+
+
+def fast_remove_background(image_bytes: bytes) -> Tuple[Optional[bytes], float]:
+    """Fast matte for encoded image bytes. Returns (RGBA PNG bytes, quality score)."""
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, 0.0
+    alpha, score = white_background_matte(img)
+    rgba = np.dstack([img, alpha])
+    ok, buffer = cv2.imencode(".png", rgba)
+    if not ok:
+        return None, 0.0
+    return buffer.tobytes(), score
+
+
+def rembg_remove_background(image_bytes: bytes) -> bytes:
+    from rembg import remove
+    return remove(image_bytes, session=get_rembg_session(), **REMBG_OPTIONS)
+
+
+def remove_background(image_bytes: bytes, mode: str = MATTING_MODE) -> bytes:
+    """
+    Remove a plain white background, sending only hard cases to rembg.
+
+    Blocking (CPU bound) - call through asyncio.to_thread from async code.
+    """
+    if mode != "rembg":
+        started = time.perf_counter()
+        matted, score = fast_remove_background(image_bytes)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if matted is not None and (mode == "fast" or score >= MATTING_MIN_QUALITY):
+            print(f"Fast matte in {elapsed_ms:.0f}ms (quality {score:.2f})")
+            return matted
+        print(f"Fast matte quality {score:.2f} below {MATTING_MIN_QUALITY}, falling back to rembg")
+
+    return rembg_remove_background(image_bytes)
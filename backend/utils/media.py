@@ -0,0 +1,326 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .deadline import remaining_timeout
+from .http_pool import get_http_client
+from .payload import PUBLIC_BASE_URL
+
+
+# Where mirrored upstream images are kept (shared by workers pointed at the same directory)
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.path.join(tempfile.gettempdir(), "jewelcraft-media"))
+# Disk budget for the mirror; least recently used images are deleted beyond it
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(64 * 1024)))
+# Longest a background mirror download may take (seconds)
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "60"))
+# Prefix of the /media URLs handed to browsers, i.e. the backend as the frontend
+# reaches it (the Next.js app rewrites /api/* to the backend)
+MEDIA_URL_PREFIX = os.getenv("MEDIA_URL_PREFIX", PUBLIC_BASE_URL or "/api").rstrip("/")
+# Lifetime assumed for upstream links whose expiry is not in the signed URL (Seedream: 24h)
+MEDIA_UPSTREAM_TTL = float(os.getenv("MEDIA_UPSTREAM_TTL", str(24 * 3600)))
+# Upstream links this close to expiring are treated as expired (seconds)
+MEDIA_EXPIRY_MARGIN = float(os.getenv("MEDIA_EXPIRY_MARGIN", "3600"))
+
+_MEDIA_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class MediaUnavailable(Exception):
+    """An image could not be mirrored (upstream error, timeout or expired link)"""
+
+
+def signed_expiry(url: str) -> Optional[float]:
+    """Expiry (epoch seconds) carried by a pre-signed URL (TOS / S3 V4 or Expires=), if any"""
+    query = {key.lower(): values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+    try:
+        for prefix in ("x-tos-", "x-amz-"):
+            if prefix + "date" in query and prefix + "expires" in query:
+                signed = datetime.strptime(query[prefix + "date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                return signed.timestamp() + float(query[prefix + "expires"])
+        if "expires" in query:
+            return float(query["expires"])
+    except ValueError:
+        pass
+    return None
+
+
+class MediaMirror:
+    """
+    Disk cache of upstream images, keyed by their URL.
+
+    Seedream hands out signed URLs that expire. mirror() starts streaming the
+    image to MEDIA_DIR in the background the moment a URL is received; later
+    readers (crops, enhancement, finalize) await that one download instead of
+    going back upstream, and browsers are served the copy from /media/{id}.
+    Each image has a JSON sidecar (URL, type, ETag) so the cache survives
+    restarts and can be shared between workers. Pinned images (bulk catalog
+    output, whose upstream links will expire) are never evicted.
+    """
+
+    def __init__(self, directory: str = MEDIA_DIR, max_bytes: int = MEDIA_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()  # id -> entry, least recently used first
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.first_seen: Dict[str, float] = {}  # id -> when its upstream URL was received
+        self.total_bytes = 0
+        self.fetched = 0
+        self.failed = 0
+        self.hits = 0
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, media_id: str) -> str:
+        return os.path.join(self.directory, media_id)
+
+    def load(self):
+        """Index images mirrored by earlier runs (oldest first). Blocking - run in a thread."""
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part"):
+                # Interrupted by a restart (recent ones may belong to another worker)
+                if os.path.getmtime(path) < time.time() - MEDIA_FETCH_TIMEOUT:
+                    os.remove(path)
+            elif name.endswith(".json") and os.path.exists(path[:-5]):
+                try:
+                    with open(path) as f:
+                        found.append((os.path.getmtime(path), json.load(f)))
+                except (OSError, ValueError):
+                    continue
+        for _, entry in sorted(found, key=lambda item: item[0]):
+            self._add(entry)
+        _remove_files(self._evict())
+
+    def _from_disk(self, media_id: str) -> Optional[dict]:
+        """Entry for an image another worker mirrored into the shared directory. Blocking - run in a thread."""
+        try:
+            with open(self.path(media_id) + ".json") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.path(media_id)):
+            return None
+        return entry
+
+    def _add(self, entry: dict):
+        previous = self.entries.pop(entry["id"], None)
+        if previous is not None:
+            self.total_bytes -= previous["size"]
+        self.entries[entry["id"]] = entry
+        self.total_bytes += entry["size"]
+
+    def _evict(self) -> List[str]:
+        """Drop entries over the size cap; returns their files for the caller to delete off the loop"""
+        # Least recently used first; pinned images and the newest one are kept
+        # even if they alone exceed the budget
+        removed = []
+        newest = next(reversed(self.entries), None)
+        for media_id in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            entry = self.entries[media_id]
+            if entry.get("pinned") or media_id == newest:
+                continue
+            del self.entries[media_id]
+            self.total_bytes -= entry["size"]
+            removed += [self.path(media_id), self.path(media_id) + ".json"]
+        return removed
+
+    def _write(self, entry: dict, data: Optional[bytes] = None):
+        """Write an entry's sidecar (and its bytes). Blocking - run in a thread."""
+        part = None
+        if data is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            part = f"{self.path(entry['id'])}.{uuid.uuid4().hex}.part"
+            with open(part, "wb") as f:
+                f.write(data)
+        self._publish(entry, part)
+
+    def _publish(self, entry: dict, part: Optional[str] = None):
+        """Atomically replace an entry's sidecar, then move its finished .part file into place. Blocking."""
+        os.makedirs(self.directory, exist_ok=True)
+        sidecar = self.path(entry["id"]) + ".json"
+        with open(sidecar + ".part", "w") as f:
+            json.dump(entry, f)
+        os.replace(sidecar + ".part", sidecar)
+        if part is not None:
+            os.replace(part, self.path(entry["id"]))
+
+    async def store(self, data: bytes, mime: str, pinned: bool = False) -> str:
+        """Keep locally produced image bytes (e.g. an inline crop); returns the media id"""
+        media_id = hashlib.sha256(data).hexdigest()[:32]
+        if media_id not in self.entries:
+            entry = {"id": media_id, "url": None, "mime": mime, "size": len(data),
+                     "etag": f'"{media_id}"', "mirrored_at": time.time(), "pinned": pinned}
+            await asyncio.to_thread(self._write, entry, data)
+            self._add(entry)
+            await asyncio.to_thread(_remove_files, self._evict())
+        elif pinned:
+            await self.pin(media_id)
+        return media_id
+
+    async def pin(self, media_id: str) -> bool:
+        """Exempt a mirrored image from eviction (waits for its download); False if it is unavailable"""
+        entry = await self.entry(media_id)
+        if entry is None:
+            return False
+        if not entry.get("pinned"):
+            entry["pinned"] = True
+            await asyncio.to_thread(self._write, entry)
+        return True
+
+    def mirror(self, url: str) -> str:
+        """Start mirroring an upstream URL unless it is cached or on its way; returns its media id"""
+        media_id = self.key(url)
+        self.first_seen.setdefault(media_id, time.time())
+        if media_id not in self.entries and media_id not in self.pending:
+            task = asyncio.create_task(self._download(media_id, url))
+            self.pending[media_id] = task
+            task.add_done_callback(lambda _: self.pending.pop(media_id, None))
+        return media_id
+
+    def known(self, url: str) -> bool:
+        media_id = self.key(url)
+        return media_id in self.entries or media_id in self.pending
+
+    def fresh(self, url: str) -> bool:
+        """Whether the upstream link itself can still be handed out (not near its expiry)"""
+        expires = signed_expiry(url)
+        if expires is None:
+            media_id = self.key(url)
+            entry = self.entries.get(media_id)
+            received = self.first_seen.get(media_id) or (entry["mirrored_at"] if entry else time.time())
+            expires = received + MEDIA_UPSTREAM_TTL
+        return time.time() < expires - MEDIA_EXPIRY_MARGIN
+
+    async def _download(self, media_id: str, url: str) -> Optional[dict]:
+        """Stream one image to disk; the file only appears once it is complete"""
+        part = f"{self.path(media_id)}.{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with get_http_client().stream("GET", url, timeout=MEDIA_FETCH_TIMEOUT) as response:
+                response.raise_for_status()
+                mime = response.headers.get("content-type", "application/octet-stream").split(";")[0].strip()
+                # File I/O goes to a thread so a slow disk never stalls the event loop
+                f = await asyncio.to_thread(_open_part, part)
+                try:
+                    async for chunk in response.aiter_bytes(MEDIA_CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            entry = {"id": media_id, "url": url, "mime": mime, "size": size,
+                     "etag": f'"{digest.hexdigest()[:32]}"', "mirrored_at": time.time()}
+            await asyncio.to_thread(self._publish, entry, part)
+        except Exception as e:
+            self.failed += 1
+            print(f"Could not mirror {url[:80]}: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}")
+            await asyncio.to_thread(_remove_files, [part])
+            return None
+        self.fetched += 1
+        self._add(entry)
+        await asyncio.to_thread(_remove_files, self._evict())
+        return entry
+
+    async def entry(self, media_id: str, timeout: float = MEDIA_FETCH_TIMEOUT) -> Optional[dict]:
+        """Cached entry for an id, waiting up to `timeout` for a download in flight"""
+        task = self.pending.get(media_id)
+        if task is not None:
+            try:
+                # Shielded: a reader giving up must not cancel the shared download
+                await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        entry = self.entries.get(media_id)
+        if entry is None:
+            entry = await asyncio.to_thread(self._from_disk, media_id)
+            if entry is not None:
+                self._add(entry)
+        if entry is not None:
+            if not await asyncio.to_thread(os.path.exists, self.path(media_id)):
+                # Deleted behind our back (e.g. tmp cleaner); forget it so it is fetched again
+                self.total_bytes -= self.entries.pop(media_id)["size"]
+                return None
+            self.entries.move_to_end(media_id)
+        return entry
+
+    async def read(self, url: str) -> Tuple[str, bytes]:
+        """
+        (mime type, bytes) of an upstream image, from the mirror.
+
+        Fetches (and mirrors) it first when it is not cached, so each image
+        is downloaded from the upstream once. Raises MediaUnavailable.
+        """
+        media_id = self.mirror(url)
+        entry = await self.entry(media_id, timeout=remaining_timeout(MEDIA_FETCH_TIMEOUT))
+        if entry is None:
+            raise MediaUnavailable(f"Could not fetch {url[:80]}")
+        self.hits += 1
+        data = await asyncio.to_thread(_read_file, self.path(media_id))
+        return entry["mime"], data
+
+    def public_url(self, url: str) -> str:
+        """URL a browser should load: the mirror copy for mirrored upstream images, otherwise unchanged"""
+        if not isinstance(url, str) or not url.startswith("http") or not self.known(url):
+            return url
+        return media_url(self.key(url))
+
+    def public_images(self, images: List[dict]) -> List[dict]:
+        return [dict(image, url=self.public_url(image["url"])) for image in images]
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self.entries),
+            "bytes": self.total_bytes,
+            "pinned_bytes": sum(e["size"] for e in self.entries.values() if e.get("pinned")),
+            "max_bytes": self.max_bytes,
+            "downloading": len(self.pending),
+            "fetched_total": self.fetched,
+            "failed_total": self.failed,
+            "reads_total": self.hits,
+        }
+
+
+def _open_part(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "wb")
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def media_url(media_id: str) -> str:
+    return f"{MEDIA_URL_PREFIX}/media/{media_id}"
+
+
+def valid_media_id(media_id: str) -> bool:
+    return bool(_MEDIA_ID.match(media_id))
+
+
+media_mirror = MediaMirror()
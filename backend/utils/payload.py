@@ -0,0 +1,176 @@
+import base64
+import io
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+# Set PAYLOAD_MINIMIZE=false to send inline images to Seedream untouched
+PAYLOAD_MINIMIZE = os.getenv("PAYLOAD_MINIMIZE", "true").lower() in ("1", "true", "yes")
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "jpeg").lower()  # jpeg or webp
+PAYLOAD_QUALITY = int(os.getenv("PAYLOAD_QUALITY", "90"))
+# When set (e.g. https://api.example.com), minimized inputs are served from
+# {PUBLIC_BASE_URL}/payloads/{id} and Seedream is given the URL instead of the bytes
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+PAYLOAD_TTL_SECONDS = float(os.getenv("PAYLOAD_TTL_SECONDS", "600"))
+PAYLOAD_STORE_MAX_BYTES = int(os.getenv("PAYLOAD_STORE_MAX_BYTES", str(200 * 1024 * 1024)))
+# Assumed uplink bandwidth, used to estimate the upload time saved
+PAYLOAD_UPLINK_MBPS = float(os.getenv("PAYLOAD_UPLINK_MBPS", "20"))
+
+# Seedream rejects inputs outside these aspect ratios (width / height)
+MIN_ASPECT = 0.33
+MAX_ASPECT = 3.0
+
+_SIZE_PRESETS = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+
+def output_max_side(size: str) -> int:
+    """Longest output edge for a Seedream size ("2K" or "1024x1024")"""
+    if size in _SIZE_PRESETS:
+        return _SIZE_PRESETS[size]
+    try:
+        width, height = (int(v) for v in size.lower().split("x"))
+        return max(width, height)
+    except (ValueError, AttributeError):
+        return 2048
+
+
+def _fit_aspect(img: Image.Image) -> Image.Image:
+    """Pad with the white backdrop so the aspect ratio is one Seedream accepts"""
+    width, height = img.size
+    aspect = width / height
+    if aspect < MIN_ASPECT:
+        canvas = Image.new("RGB", (int(height * MIN_ASPECT) + 1, height), "white")
+    elif aspect > MAX_ASPECT:
+        canvas = Image.new("RGB", (width, int(width / MAX_ASPECT) + 1), "white")
+    else:
+        return img
+    canvas.paste(img, ((canvas.width - width) // 2, (canvas.height - height) // 2))
+    return canvas
+
+
+def minimize_image_bytes(image_bytes: bytes, max_side: int) -> Tuple[bytes, str]:
+    """
+    Resize to at most `max_side` and re-encode compactly.
+
+    Transparent areas are flattened onto white (our images are white-background
+    product shots). Returns (bytes, mime type). Blocking - run in a thread.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        flattened = Image.new("RGB", img.size, "white")
+        flattened.paste(img, mask=img.split()[-1])
+        img = flattened
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    img = _fit_aspect(img)
+
+    buffer = io.BytesIO()
+    if PAYLOAD_FORMAT == "webp":
+        img.save(buffer, format="WEBP", quality=PAYLOAD_QUALITY, method=4)
+        return buffer.getvalue(), "image/webp"
+    img.save(buffer, format="JPEG", quality=PAYLOAD_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+class PayloadStore:
+    """Short-lived, size-bounded in-memory store for inputs served to Seedream by URL"""
+
+    def __init__(self, ttl: float = PAYLOAD_TTL_SECONDS, max_bytes: int = PAYLOAD_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # id -> (expires_at, mime, bytes)
+        self.total_bytes = 0
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.items:
+            payload_id, (expires_at, _, data) = next(iter(self.items.items()))
+            if expires_at > now and self.total_bytes <= self.max_bytes:
+                break
+            del self.items[payload_id]
+            self.total_bytes -= len(data)
+
+    def put(self, data: bytes, mime: str) -> str:
+        payload_id = uuid.uuid4().hex
+        self.items[payload_id] = (time.monotonic() + self.ttl, mime, data)
+        self.total_bytes += len(data)
+        self._evict()
+        return payload_id
+
+    def get(self, payload_id: str) -> Optional[Tuple[str, bytes]]:
+        self._evict()
+        item = self.items.get(payload_id)
+        if item is None:
+            return None
+        return item[1], item[2]
+
+
+class PayloadStats:
+    def __init__(self):
+        self.requests = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.encode_seconds = 0.0
+        self.served_by_url = 0
+
+    def record(self, original: int, sent: int, encode_seconds: float, by_url: bool):
+        self.requests += 1
+        self.original_bytes += original
+        self.sent_bytes += sent
+        self.encode_seconds += encode_seconds
+        self.served_by_url += int(by_url)
+
+    def report(self) -> dict:
+        saved = self.original_bytes - self.sent_bytes
+        bytes_per_second = PAYLOAD_UPLINK_MBPS * 1_000_000 / 8
+        return {
+            "requests": self.requests,
+            "original_bytes": self.original_bytes,
+            "sent_bytes": self.sent_bytes,
+            "bytes_saved": saved,
+            "served_by_url": self.served_by_url,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "estimated_upload_seconds_saved": round(saved / bytes_per_second, 2),
+            "assumed_uplink_mbps": PAYLOAD_UPLINK_MBPS,
+        }
+
+
+payload_store = PayloadStore()
+payload_stats = PayloadStats()
+
+
+def minimize_data_url(data_url: str, size: str) -> str:
+    """
+    Shrink an inline image for an image-to-image request producing `size`.
+
+    Returns a locally served URL when PUBLIC_BASE_URL is configured, otherwise
+    a compact data URL. Blocking - run in a thread.
+    """
+    started = time.perf_counter()
+    original = base64.b64decode(data_url.split(",", 1)[1])
+    data, mime = minimize_image_bytes(original, output_max_side(size))
+    width, height = Image.open(io.BytesIO(original)).size
+    aspect_ok = MIN_ASPECT <= width / height <= MAX_ASPECT
+    if len(data) >= len(original) and aspect_ok and not PUBLIC_BASE_URL:
+        data_url_out = data_url  # Re-encoding did not help; keep what we had
+        sent = len(original)
+    elif PUBLIC_BASE_URL:
+        data_url_out = f"{PUBLIC_BASE_URL}/payloads/{payload_store.put(data, mime)}"
+        sent = len(data_url_out)
+    else:
+        data_url_out = f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+        sent = len(data)
+    elapsed = time.perf_counter() - started
+    payload_stats.record(len(original), sent, elapsed, by_url=bool(PUBLIC_BASE_URL))
+    print(f"Upstream payload {len(original) / 1024:.0f}KB -> {sent / 1024:.0f}KB in {elapsed * 1000:.0f}ms")
+    return data_url_out
@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+
+# Cached outputs kept per memoized stage (least recently used are evicted)
+PIPELINE_MEMO_SIZE = int(os.getenv("PIPELINE_MEMO_SIZE", "16"))
+PIPELINE_PROCESS_WORKERS = int(os.getenv("PIPELINE_PROCESS_WORKERS", "2"))
+
+# "async": coroutine function on the event loop; "inline": cheap plain function
+# called directly; "thread" / "process": plain function run in an executor
+EXECUTORS = ("async", "inline", "thread", "process")
+
+
+class PipelineError(Exception):
+    """A pipeline graph is malformed, or a stage got or produced a value of the wrong type"""
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _default_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # Spawned, not forked: the server process already runs event-loop and executor threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PIPELINE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def shutdown_pools():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _type_name(expected) -> str:
+    if isinstance(expected, tuple):
+        return " | ".join(t.__name__ for t in expected)
+    return expected.__name__
+
+
+class Stage:
+    """
+    One named step of a pipeline graph.
+
+    `inputs` maps argument names to expected types (a type or a tuple of
+    types); each is a pipeline input or the `output` of another stage. A stage
+    starts as soon as all of its inputs exist, so independent stages overlap.
+
+    `concurrency` caps how many calls of this stage run at once across all
+    requests. With `map_over`, `func(key, item, **other_inputs)` is called for
+    each item of that dict or list input and the output has the same shape;
+    the concurrency cap then applies per item. `memoize` caches outputs keyed
+    by the inputs (True, or a predicate deciding whether a result may be cached).
+    """
+
+    def __init__(self, name: str, func: Callable, inputs: Dict[str, Any], output: str,
+                 output_type: Any = object, executor: str = "async", concurrency: Optional[int] = None,
+                 memoize: Union[bool, Callable[[Any], bool]] = False, map_over: Optional[str] = None,
+                 pool: Optional[Callable[[], Executor]] = None):
+        if executor not in EXECUTORS:
+            raise PipelineError(f"Stage '{name}': unknown executor '{executor}'")
+        if map_over is not None and map_over not in inputs:
+            raise PipelineError(f"Stage '{name}': map_over '{map_over}' is not one of its inputs")
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.output = output
+        self.output_type = output_type
+        self.executor = executor
+        self.concurrency = concurrency
+        self.memoize = memoize
+        self.map_over = map_over
+        self.pool = pool or (_default_process_pool if executor == "process" else None)
+        self.memo = OrderedDict()
+        self.memo_hits = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> Optional[asyncio.Semaphore]:
+        if self.concurrency and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _memo_key(self, args: tuple, kwargs: dict) -> str:
+        digest = hashlib.sha256()
+        for value in args + tuple(sorted(kwargs.items())):
+            # Image bytes are hashed as-is; repr() of megabytes would be slow and 4x larger
+            digest.update(value if isinstance(value, bytes) else repr(value).encode("utf-8"))
+        return digest.hexdigest()
+
+    async def _execute(self, args: tuple, kwargs: dict):
+        call = functools.partial(self.func, *args, **kwargs)
+        if self.executor == "async":
+            return await call()
+        if self.executor == "inline":
+            return call()
+        if self.executor == "thread":
+            return await asyncio.to_thread(call)
+        return await asyncio.get_running_loop().run_in_executor(self.pool(), call)
+
+    async def _invoke(self, args: tuple, kwargs: dict):
+        key = self._memo_key(args, kwargs) if self.memoize else None
+        if key is not None and key in self.memo:
+            self.memo_hits += 1
+            self.memo.move_to_end(key)
+            return self.memo[key]
+
+        if self.semaphore is not None:
+            async with self.semaphore:
+                result = await self._execute(args, kwargs)
+        else:
+            result = await self._execute(args, kwargs)
+
+        if key is not None and (self.memoize is True or self.memoize(result)):
+            self.memo[key] = result
+            while len(self.memo) > PIPELINE_MEMO_SIZE:
+                self.memo.popitem(last=False)
+        return result
+
+    async def run(self, values: dict):
+        kwargs = {name: values[name] for name in self.inputs}
+        if self.map_over is None:
+            return await self._invoke((), kwargs)
+        items = kwargs.pop(self.map_over)
+        keys = list(items) if isinstance(items, dict) else list(range(len(items)))
+        results = await asyncio.gather(*[self._invoke((key, items[key]), kwargs) for key in keys])
+        return dict(zip(keys, results)) if isinstance(items, dict) else list(results)
+
+
+class StageStats:
+    """Timing per stage across runs, reported by /stats/pipelines"""
+
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+
+    def record(self, key: str, seconds: float):
+        stats = self.stages.setdefault(key, {"runs": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["runs"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def report(self, pipelines: List["Pipeline"]) -> dict:
+        memo_hits = {f"{p.name}.{s.name}": s.memo_hits for p in pipelines for s in p.stages if s.memoize}
+        return {
+            key: {
+                "runs": stats["runs"],
+                "avg_seconds": round(stats["total_seconds"] / stats["runs"], 3),
+                "max_seconds": round(stats["max_seconds"], 3),
+                **({"memo_hits": memo_hits[key]} if key in memo_hits else {}),
+            }
+            for key, stats in sorted(self.stages.items())
+        }
+
+
+stage_stats = StageStats()
+
+
+class Pipeline:
+    """
+    A DAG of stages, validated when it is built.
+
+    Every stage input must be a pipeline input or another stage's output with
+    a matching declared type, and the graph must be acyclic. run() starts each
+    stage as soon as its inputs are ready and records its wall time.
+    """
+
+    def __init__(self, name: str, stages: List[Stage]):
+        self.name = name
+        self.stages = stages
+        self.producers: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.output in self.producers:
+                raise PipelineError(f"Pipeline '{name}': '{stage.output}' is produced by more than one stage")
+            self.producers[stage.output] = stage
+
+        self.inputs: Dict[str, Any] = {}
+        for stage in stages:
+            for arg, expected in stage.inputs.items():
+                producer = self.producers.get(arg)
+                if producer is None:
+                    self.inputs.setdefault(arg, expected)
+                    continue
+                produced = producer.output_type
+                if expected is not object and produced is not object and produced != expected:
+                    raise PipelineError(
+                        f"Pipeline '{name}': stage '{stage.name}' expects {arg}: {_type_name(expected)} "
+                        f"but '{producer.name}' produces {_type_name(produced)}"
+                    )
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(stage: Stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise PipelineError(f"Pipeline '{self.name}': cycle through stage '{stage.name}'")
+            visiting.add(stage.name)
+            for arg in stage.inputs:
+                if arg in self.producers:
+                    visit(self.producers[arg])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+
+        for stage in self.stages:
+            visit(stage)
+
+    def _check_type(self, label: str, value, expected):
+        if expected is not object and not isinstance(value, expected):
+            raise PipelineError(
+                f"Pipeline '{self.name}': {label} should be {_type_name(expected)}, got {type(value).__name__}"
+            )
+
+    async def run(self, **inputs) -> dict:
+        """Run the graph; returns every input and stage output by name, plus 'timings'"""
+        missing = set(self.inputs) - set(inputs)
+        if missing:
+            raise PipelineError(f"Pipeline '{self.name}': missing inputs {sorted(missing)}")
+        for arg, expected in self.inputs.items():
+            self._check_type(f"input '{arg}'", inputs[arg], expected)
+
+        loop = asyncio.get_running_loop()
+        ready = {name: loop.create_future() for name in list(inputs) + list(self.producers)}
+        for name, value in inputs.items():
+            ready[name].set_result(value)
+        timings: Dict[str, float] = {}
+
+        async def run_stage(stage: Stage):
+            values = {arg: await ready[arg] for arg in stage.inputs}
+            started = time.perf_counter()
+            result = await stage.run(values)
+            elapsed = time.perf_counter() - started
+            self._check_type(f"stage '{stage.name}' output", result, stage.output_type)
+            timings[stage.name] = elapsed
+            stage_stats.record(f"{self.name}.{stage.name}", elapsed)
+            ready[stage.output].set_result(result)
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(run_stage(stage)) for stage in self.stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        total = time.perf_counter() - started
+        print(f"Pipeline {self.name} finished in {total:.2f}s: "
+              + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items()))
+
+        results = {name: future.result() for name, future in ready.items()}
+        results["timings"] = {**timings, "total": total}
+        return results
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from .circuit_breaker import CircuitOpenError, breaker_for
+from .deadline import remaining_timeout
+from .hedging import LatencyTracker, hedged
+from .http_pool import get_http_client
+from .media import MediaUnavailable, media_mirror
+from .payload import PAYLOAD_MINIMIZE, PUBLIC_BASE_URL, minimize_data_url
+
+
+SEEDREAM_API_URL = "https://ark.ap-southeast.bytepluses.com/api/v3/images/generations"
+SEEDREAM_MODEL = "seedream-4-0-250828"
+# Billed price per generated image, used for cost reporting only
+SEEDREAM_COST_PER_IMAGE = float(os.getenv("SEEDREAM_COST_PER_IMAGE", "0.03"))
+
+
+_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("seedream_usage", default=None)
+
+
+@contextmanager
+def track_usage():
+    """Count Seedream requests and billed images made inside the block (and its tasks)"""
+    usage = {"calls": 0, "images": 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def usage_cost(usage: dict) -> float:
+    return round(usage["images"] * SEEDREAM_COST_PER_IMAGE, 4)
+
+
+class SeedreamError(Exception):
+    """Seedream answered but did not produce an image"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SeedreamClient:
+    """Thin client for the Seedream 4.0 generations endpoint with hedging and deadlines"""
+
+    def __init__(self):
+        self.api_key = os.getenv("ARK_API_KEY")
+        self.enabled = bool(self.api_key)
+        # Latency history per logical endpoint (text-to-image, image-to-image, ...)
+        self.trackers = {}
+
+    def tracker(self, endpoint: str) -> LatencyTracker:
+        if endpoint not in self.trackers:
+            self.trackers[endpoint] = LatencyTracker()
+        return self.trackers[endpoint]
+
+    async def generate(self, payload: dict, endpoint: str = "generations", timeout: float = 120.0,
+                       hedge: bool = True) -> str:
+        """Send a generation request and return the first image URL (see generate_many)"""
+        return (await self.generate_many(payload, endpoint, timeout, hedge=hedge))[0]
+
+    async def generate_many(self, payload: dict, endpoint: str = "generations", timeout: float = 120.0,
+                            hedge: bool = True) -> List[str]:
+        """
+        Send a generation request and return every image URL in the response.
+
+        Generation calls have no side effects upstream, so they are hedged and
+        bounded by the current request deadline. Pass hedge=False for calls
+        that bill several images or render slowly by nature (image sets, 4K
+        composites): a duplicate would double their cost for little gain.
+        Raises SeedreamError when the upstream rejects the request,
+        DeadlineExceeded when the budget runs out and CircuitOpenError
+        straight away while the endpoint's breaker is open.
+
+        An input image that is a mirrored upstream link is sent as the link
+        while it is fresh (no upload). Near its expiry, or when Seedream
+        rejects it, the mirror's copy is sent instead.
+        """
+        breaker = breaker_for("seedream", endpoint)
+        if breaker.would_reject():
+            raise CircuitOpenError(f"Seedream {endpoint} circuit is open")
+
+        image = link = payload.get("image")
+        mirrored_link = isinstance(link, str) and link.startswith("http") and media_mirror.known(link)
+        if mirrored_link and not media_mirror.fresh(link):
+            try:
+                payload = await self._from_mirror(payload)
+                image = payload["image"]
+            except MediaUnavailable as e:
+                print(f"Mirror copy unavailable, sending the upstream URL: {e}")
+        if PAYLOAD_MINIMIZE and isinstance(image, str) and image.startswith("data:"):
+            try:
+                minimized = await asyncio.to_thread(minimize_data_url, image, payload.get("size", "2K"))
+                payload = dict(payload, image=minimized)
+            except Exception as e:
+                print(f"Could not minimize upstream payload, sending original: {e}")
+
+        body = {"model": SEEDREAM_MODEL, "response_format": "url", "watermark": False}
+        body.update(payload)
+
+        async def attempt() -> List[str]:
+            # Admitted right before the call: a cancellation during the mirror or
+            # minimize awaits above, or of a duplicate that never started, holds no probe
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Seedream {endpoint} circuit is open")
+
+            started = time.monotonic()
+            try:
+                image_urls = await self._post(body, endpoint, timeout)
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except SeedreamError as e:
+                # 4xx answers mean the upstream is healthy but rejected our input
+                if e.status_code is not None and e.status_code < 500 and e.status_code != 429:
+                    breaker.record_success(time.monotonic() - started)
+                else:
+                    breaker.record_failure(time.monotonic() - started)
+                raise
+            except Exception:
+                breaker.record_failure(time.monotonic() - started)
+                raise
+            breaker.record_success(time.monotonic() - started)
+            return image_urls
+
+        try:
+            image_urls = await hedged(attempt, self.tracker(endpoint), label=f"seedream {endpoint}",
+                                      max_attempts=2 if hedge else 1)
+        except SeedreamError as e:
+            if not (mirrored_link and body.get("image") == link and e.status_code == 400):
+                raise
+            # Most likely Seedream could not download the link (expired early); our copy cannot expire
+            print(f"Seedream {endpoint} rejected the upstream link, retrying with the mirrored copy")
+            try:
+                retry_payload = await self._from_mirror(payload)
+            except MediaUnavailable:
+                raise e
+            return await self.generate_many(retry_payload, endpoint, timeout, hedge=hedge)
+        for url in image_urls:
+            if url.startswith("http"):
+                media_mirror.mirror(url)  # Signed URLs expire; keep our own copy from the start
+        return image_urls
+
+    async def _from_mirror(self, payload: dict) -> dict:
+        """Payload with its input link replaced by our mirrored copy (raises MediaUnavailable)"""
+        image = payload["image"]
+        if PUBLIC_BASE_URL:
+            media_id = media_mirror.key(image)
+            if await media_mirror.entry(media_id, timeout=remaining_timeout(30.0)) is None:
+                raise MediaUnavailable(f"Could not fetch {image[:80]}")
+            return dict(payload, image=f"{PUBLIC_BASE_URL}/media/{media_id}")
+        mime, data = await media_mirror.read(image)
+        return dict(payload, image=f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}")
+
+    async def _post(self, body: dict, endpoint: str, timeout: float) -> List[str]:
+        usage = _usage.get()
+        if usage is not None:
+            usage["calls"] += 1
+        response = await get_http_client().post(
+            SEEDREAM_API_URL,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json=body,
+            timeout=remaining_timeout(timeout)
+        )
+
+        if response.status_code != 200:
+            print(f"Seedream {endpoint} error {response.status_code}: {response.text[:500]}")
+            raise SeedreamError(f"Seedream returned {response.status_code}", response.status_code)
+
+        data = response.json()
+        if usage is not None:
+            usage["images"] += len(data.get("data") or [])
+        image_urls = [item["url"] for item in data.get("data") or [] if item.get("url")]
+        if image_urls:
+            return image_urls
+
+        print(f"No images in Seedream {endpoint} response: {data}")
+        raise SeedreamError("No image in Seedream response")
+
+
+_shared_client: Optional[SeedreamClient] = None
+
+
+def shared_seedream_client() -> SeedreamClient:
+    """Process-wide client so latency history is shared by every caller"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = SeedreamClient()
+    return _shared_client
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import time
+from typing import Dict, List, Optional
+
+
+# Versions kept per session (the oldest are dropped first; the current one never is)
+VERSION_MAX_DEPTH = int(os.getenv("VERSION_MAX_DEPTH", "20"))
+# Unique asset bytes a session's history may hold (inline data URLs dominate)
+VERSION_MAX_BYTES = int(os.getenv("VERSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Session fields captured in every version besides the images
+VERSIONED_FIELDS = ("metal", "gemstone", "band_shape")
+
+
+class AssetStore:
+    """
+    Content-addressed image references shared by every session's history.
+
+    An asset is the URL or data URL of one image, keyed by its SHA-256, so a
+    crop that several versions (or sessions) point at is stored once.
+    Reference counted: an asset is dropped when no version refers to it.
+    """
+
+    def __init__(self):
+        self.assets: Dict[str, str] = {}
+        self.refs: Dict[str, int] = {}
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def put(self, url: str) -> str:
+        asset_id = self.key(url)
+        if asset_id not in self.assets:
+            self.assets[asset_id] = url
+            self.refs[asset_id] = 0
+        self.refs[asset_id] += 1
+        return asset_id
+
+    def get(self, asset_id: str) -> str:
+        return self.assets[asset_id]
+
+    def size(self, asset_id: str) -> int:
+        return len(self.assets[asset_id])
+
+    def release(self, asset_id: str):
+        self.refs[asset_id] -= 1
+        if self.refs[asset_id] <= 0:
+            del self.refs[asset_id]
+            del self.assets[asset_id]
+
+    def stats(self) -> dict:
+        return {"assets": len(self.assets), "bytes": sum(len(url) for url in self.assets.values())}
+
+
+asset_store = AssetStore()
+
+
+class SessionHistory:
+    """
+    Immutable version chain for one design session.
+
+    Every version is a tuple of (angle, asset id, tier) entries plus the
+    material fields; moving between versions only moves a pointer, so undo,
+    redo and jumps never touch the upstream API. Committing after an undo
+    discards the redo branch, like an editor.
+    """
+
+    def __init__(self, store: AssetStore = asset_store, max_depth: int = VERSION_MAX_DEPTH,
+                 max_bytes: int = VERSION_MAX_BYTES):
+        self.store = store
+        self.max_depth = max(1, max_depth)
+        self.max_bytes = max_bytes
+        self.versions: List[dict] = []
+        self.position = -1
+        self.next_number = 1
+
+    @property
+    def current(self) -> Optional[dict]:
+        return self.versions[self.position] if self.versions else None
+
+    def commit(self, images: List[dict], fields: dict, label: str) -> dict:
+        """Record a new version after the current one and make it current"""
+        for dropped in self.versions[self.position + 1:]:
+            self._release(dropped)
+        del self.versions[self.position + 1:]
+
+        version = {
+            "version": self.next_number,
+            "label": label,
+            "created_at": time.time(),
+            "images": tuple((image["angle"], self.store.put(image["url"]), image.get("tier")) for image in images),
+            "fields": {name: fields.get(name) for name in VERSIONED_FIELDS},
+        }
+        self.next_number += 1
+        self.versions.append(version)
+        self.position = len(self.versions) - 1
+        self._trim()
+        return version
+
+    def _release(self, version: dict):
+        for _, asset_id, _ in version["images"]:
+            self.store.release(asset_id)
+
+    def storage_bytes(self) -> int:
+        unique = {asset_id for version in self.versions for _, asset_id, _ in version["images"]}
+        return sum(self.store.size(asset_id) for asset_id in unique)
+
+    def _trim(self):
+        # Drop the oldest versions, but never the current one
+        while self.position > 0 and (len(self.versions) > self.max_depth or self.storage_bytes() > self.max_bytes):
+            self._release(self.versions.pop(0))
+            self.position -= 1
+
+    def undo(self) -> Optional[dict]:
+        if self.position <= 0:
+            return None
+        self.position -= 1
+        return self.current
+
+    def redo(self) -> Optional[dict]:
+        if self.position >= len(self.versions) - 1:
+            return None
+        self.position += 1
+        return self.current
+
+    def jump(self, number: int) -> Optional[dict]:
+        for index, version in enumerate(self.versions):
+            if version["version"] == number:
+                self.position = index
+                return version
+        return None
+
+    def images(self, version: dict) -> List[dict]:
+        return [
+            {"angle": angle, "url": self.store.get(asset_id), "tier": tier}
+            for angle, asset_id, tier in version["images"]
+        ]
+
+    def summary(self) -> dict:
+        current = self.current
+        return {
+            "current_version": current["version"] if current else None,
+            "can_undo": self.position > 0,
+            "can_redo": self.position < len(self.versions) - 1,
+            "storage_bytes": self.storage_bytes(),
+            "versions": [
+                {
+                    "version": v["version"],
+                    "label": v["label"],
+                    "created_at": v["created_at"],
+                    "images": len(v["images"]),
+                    "tiers": sorted({tier for _, _, tier in v["images"] if tier}),
+                    **v["fields"],
+                }
+                for v in self.versions
+            ],
+        }
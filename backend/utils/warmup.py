@@ -0,0 +1,126 @@
+import asyncio
+import importlib
+import os
+import time
+
+
+# Set WARMUP_ENABLED=false to skip warm-up (the worker is then ready at once and
+# pays model loading on the first request instead).
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Comma separated subset of: imaging, matting, rembg, enhancer, http
+WARMUP_STEPS = [
+    step.strip() for step in os.getenv("WARMUP_STEPS", "imaging,matting,rembg,enhancer,http").split(",") if step.strip()
+]
+# Time allowed for the http step's connection to the Seedream host
+WARMUP_HTTP_TIMEOUT = float(os.getenv("WARMUP_HTTP_TIMEOUT", "5"))
+
+
+class WarmupState:
+    """Progress of the background warm-up, reported by /readyz"""
+
+    def __init__(self):
+        self.started_at = None
+        self.finished_at = None
+        self.step_seconds = {}
+        self.errors = {}
+        self.import_seconds = {}
+
+    @property
+    def ready(self) -> bool:
+        return not WARMUP_ENABLED or self.finished_at is not None
+
+    def report(self) -> dict:
+        report = {
+            "ready": self.ready,
+            "enabled": WARMUP_ENABLED,
+            "import_seconds": {k: round(v, 3) for k, v in self.import_seconds.items()},
+            "warmup_seconds": {k: round(v, 3) for k, v in self.step_seconds.items()},
+        }
+        if self.started_at is not None:
+            end = self.finished_at or time.perf_counter()
+            report["warmup_total_seconds"] = round(end - self.started_at, 3)
+        if self.errors:
+            report["errors"] = self.errors
+        return report
+
+
+warmup_state = WarmupState()
+
+
+def record_import(name: str, seconds: float):
+    warmup_state.import_seconds[name] = seconds
+
+
+def _warm_imaging():
+    for module in ("numpy", "cv2"):
+        started = time.perf_counter()
+        importlib.import_module(module)
+        record_import(module, time.perf_counter() - started)
+
+
+def _warm_matting():
+    # First call into OpenCV/NumPy kernels allocates and initialises thread pools
+    import numpy as np
+    from .matting import white_background_matte
+    img = np.full((256, 256, 3), 255, np.uint8)
+    img[96:160, 96:160] = (40, 170, 215)
+    white_background_matte(img)
+
+
+def _warm_rembg():
+    from .matting import MATTING_MODE, get_rembg_session
+    if MATTING_MODE == "fast":
+        return
+    started = time.perf_counter()
+    importlib.import_module("rembg")
+    record_import("rembg", time.perf_counter() - started)
+    get_rembg_session()
+
+
+def _warm_enhancer():
+    from .local_enhancer import local_enhancer
+    local_enhancer.warm_up()
+
+
+async def _warm_http():
+    # A HEAD to the Seedream host resolves DNS and completes the TLS handshake,
+    # leaving an open connection in the shared pool for the first generation.
+    # Any HTTP status will do; only a connection error fails the step.
+    import httpx
+    from .http_pool import get_http_client
+    from .seedream_client import SEEDREAM_API_URL
+    origin = httpx.URL(SEEDREAM_API_URL).copy_with(path="/", query=None)
+    await get_http_client().head(origin, timeout=WARMUP_HTTP_TIMEOUT)
+
+
+_BLOCKING_STEPS = {
+    "imaging": _warm_imaging,
+    "matting": _warm_matting,
+    "rembg": _warm_rembg,
+    "enhancer": _warm_enhancer,
+}
+
+
+async def run_warmup():
+    """Preload heavy dependencies off the event loop, one step at a time"""
+    if not WARMUP_ENABLED:
+        return
+    warmup_state.started_at = time.perf_counter()
+    print(f"Warm-up starting: {', '.join(WARMUP_STEPS)}")
+    for step in WARMUP_STEPS:
+        started = time.perf_counter()
+        try:
+            if step == "http":
+                await _warm_http()
+            elif step in _BLOCKING_STEPS:
+                await asyncio.to_thread(_BLOCKING_STEPS[step])
+            else:
+                print(f"Unknown warm-up step '{step}', skipping")
+                continue
+        except Exception as e:
+            # A failed step leaves that dependency to load lazily on first use
+            print(f"Warm-up step '{step}' failed: {e}")
+            warmup_state.errors[step] = str(e)
+        warmup_state.step_seconds[step] = time.perf_counter() - started
+    warmup_state.finished_at = time.perf_counter()
+    print(f"Warm-up finished in {warmup_state.finished_at - warmup_state.started_at:.2f}s")